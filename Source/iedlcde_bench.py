@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+"""
+Infinity ErgoDox LCD Editor benchmarks, by LuX
+Times image packing, firmware patching, LCD command encoding and previews
+on an emulated keyboard, and saves the results as JSON so runs of different
+commits can be compared.
+
+Code distributed "as is", use at your own risk
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import perf_counter, time
+
+from iedlcde_core import (
+    __version__, DEFAULT_COLORS, DFU_SIGNATURE, DFU_SUFFIX_LENGTH,
+    PATCH_MARKERS, PATCH_SKIP, THEME_SLOT_SIZES, LCDUpload, SerialSession,
+    build_firmware, build_patches, dfu_crc, find_patches, lcd_color_command,
+    lcd_frame, pack_image, read_patches, verify_firmware)
+
+
+# GLOBALS
+BENCH_SEED = 82904
+BENCH_FIRMWARE_SIZES = (1, 4)  # MB
+BENCH_REGRESSION = 1.2  # slower by this factor is reported as a regression
+
+
+def synthetic_image(rng):
+    """Returns a random 128 x 32 black-white image"""
+
+    from PIL import Image
+
+    image = Image.new("1", (128, 32))
+    image.frombytes(bytes(rng.getrandbits(8) for i in range(128 * 32 // 8)))
+    return image
+
+
+def synthetic_firmware(filename, size, rng):
+    """Writes a .dfu.bin file of about size bytes with the patch markers
+
+    The markers are spread over the file, in the order the firmware has
+    them, and the file ends with a DFU suffix with a valid CRC.
+    """
+
+    data = bytearray(rng.getrandbits(8) for i in range(4096)) * \
+        (size // 4096 + 1)
+    del data[size - DFU_SUFFIX_LENGTH:]
+
+    for n, marker in enumerate(PATCH_MARKERS):
+        offset = (n + 1) * len(data) // (len(PATCH_MARKERS) + 1)
+        data[offset:offset + len(marker) + PATCH_SKIP[n]] = \
+            marker + bytes(PATCH_SKIP[n])
+
+    data += b'\xff\xff\xff\xff\xff\xff\x00\x01' + DFU_SIGNATURE + \
+        bytes([DFU_SUFFIX_LENGTH])
+    data += dfu_crc(data).to_bytes(4, 'little')
+
+    with open(filename, 'wb') as outfile:
+        outfile.write(data)
+
+
+def measure(job, repeat, setup=None):
+    """Runs job repeat times, returns the seconds of each run
+
+    setup runs before every run and isn't timed.
+    """
+
+    times = []
+    for r in range(repeat):
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        job()
+        times.append(perf_counter() - start)
+
+    return times
+
+
+def summary(times, **extra):
+    """Returns the JSON result of a benchmark"""
+
+    times = sorted(times)
+    result = {
+        'runs': len(times),
+        'min': times[0],
+        'median': times[len(times) // 2],
+        'mean': sum(times) / len(times),
+        'max': times[-1],
+    }
+    result.update(extra)
+    return result
+
+
+def bench_packing(rng, repeat):
+    """Packing the 8 images into LCD data"""
+
+    images = [synthetic_image(rng) for i in range(8)]
+    return {
+        'pack_image': summary(measure(
+            lambda: [pack_image(image) for image in images], repeat),
+            images=8),
+    }
+
+
+def check_firmware(output, images):
+    """Raises ValueError unless a built firmware is valid and holds images"""
+
+    if verify_firmware(output) != (True, [True] * len(PATCH_MARKERS)):
+        raise ValueError("built firmware isn't valid")
+    with open(output, 'rb') as infile:
+        if read_patches(infile.read())[0] != images:
+            raise ValueError("built firmware doesn't hold the images")
+
+
+def bench_firmware(rng, repeat, directory):
+    """Patching synthetic firmware files, in place (cold and with a cached
+    index) and streamed (cold)"""
+
+    images = [bytearray(rng.getrandbits(8) for i in range(size))
+              for size in THEME_SLOT_SIZES]
+    patches = build_patches(images, DEFAULT_COLORS)
+    results = {
+        'build_patches': summary(measure(
+            lambda: build_patches(
+                [bytes(size) for size in THEME_SLOT_SIZES], DEFAULT_COLORS),
+            repeat)),
+    }
+
+    # Patches that don't fit in place, for the streaming fallback
+    oversized = build_patches([bytes(512)] * 8, DEFAULT_COLORS)
+
+    for size in BENCH_FIRMWARE_SIZES:
+        firmware = os.path.join(directory, "bench_{0}mb.dfu.bin".format(size))
+        output = os.path.join(directory, "custom_bench.dfu.bin")
+        synthetic_firmware(firmware, size << 20, rng)
+        index = os.path.join(directory, '.' + os.path.basename(firmware) +
+                             '.idx')
+
+        with open(firmware, 'rb') as infile:
+            data = infile.read()
+        results['find_patches_{0}mb'.format(size)] = summary(measure(
+            lambda: find_patches(data), repeat), bytes=len(data))
+
+        def forget_index():
+            if os.path.exists(index):
+                os.remove(index)
+
+        results['build_firmware_{0}mb'.format(size)] = summary(measure(
+            lambda: build_firmware(firmware, output, patches), repeat,
+            forget_index), bytes=len(data))
+        check_firmware(output, images)
+
+        results['build_firmware_{0}mb_streamed'.format(size)] = summary(
+            measure(lambda: build_firmware(firmware, output, oversized),
+                    repeat, forget_index), bytes=len(data))
+        if verify_firmware(output) != (True, [True] * len(PATCH_MARKERS)):
+            raise ValueError("streamed firmware isn't valid")
+
+        # Warm the index, the file must be older than its racy window
+        build_firmware(firmware, output, patches)
+        os.utime(firmware, (time() - 10, time() - 10))
+        build_firmware(firmware, output, patches)
+        results['build_firmware_{0}mb_indexed'.format(size)] = summary(
+            measure(lambda: build_firmware(firmware, output, patches),
+                    repeat), bytes=len(data))
+        check_firmware(output, images)
+
+    return results
+
+
+def bench_encoding(rng, repeat):
+    """Encoding LCD commands"""
+
+    frame = lcd_frame(bytes(rng.getrandbits(8) for i in range(512)))
+    color = (10000, 20000, 30000)
+    upload = LCDUpload(color, frame)
+
+    return {
+        'lcd_upload_compile': summary(measure(
+            lambda: LCDUpload(color, frame), repeat),
+            bytes=len(upload.buffer)),
+        'lcd_color_command': summary(measure(
+            lambda: lcd_color_command(color), repeat)),
+    }
+
+
+def bench_preview(rng, repeat, latency):
+    """Previews on an emulated keyboard, end to end over the pty"""
+
+    from iedlcde_emulator import IEDEmulator
+
+    frames = [lcd_frame(bytes(rng.getrandbits(8) for i in range(512)))
+              for k in range(2)]
+    uploads = [LCDUpload((10000, 20000, 30000), frame) for frame in frames]
+
+    # Half the segments change between the two delta frames
+    delta = bytearray(frames[0])
+    for start in range(0, 512, 32):
+        delta[start:start + 16] = frames[1][start:start + 16]
+    delta_upload = LCDUpload(uploads[0].color, delta)
+
+    results = {}
+    with IEDEmulator(dict.fromkeys(
+            (b'lcdInit', b'lcdColor', b'lcdDisp'), latency)) as emulator:
+        session = SerialSession(emulator.port)
+        session.open()
+        try:
+            def full():
+                session.shadow.invalidate()
+                session.preview(uploads[0], None)
+
+            times = measure(full, repeat)
+            if bytes(emulator.frame) != uploads[0].frame:
+                raise ValueError("emulated LCD doesn't show the preview")
+            results['preview_full'] = summary(
+                times, bytes=len(uploads[0].buffer), latency=latency)
+
+            toggle = [uploads[0], delta_upload]
+
+            def changed():
+                toggle.reverse()
+                session.preview(toggle[0], None)
+
+            results['preview_delta'] = summary(
+                measure(changed, repeat), latency=latency)
+
+            results['preview_unchanged'] = summary(measure(
+                lambda: session.preview(toggle[0], None), repeat),
+                latency=latency)
+
+            # Throughput of streaming different frames
+            count = max(repeat, 10)
+            sent = session.transport.bytes_sent
+            start = perf_counter()
+            for k in range(count):
+                session.upload(uploads[k % 2])
+            session.transport.flush()
+            elapsed = perf_counter() - start
+            results['stream'] = summary(
+                [elapsed / count], frames=count, latency=latency,
+                fps=count / elapsed,
+                bytes_per_second=(session.transport.bytes_sent - sent) /
+                elapsed)
+        finally:
+            session.close()
+
+        if emulator.errors:
+            raise ValueError("emulated keyboard lost {0} commands".format(
+                len(emulator.errors)))
+
+    return results
+
+
+def git_commit():
+    """Returns the commit of the working tree, or None"""
+
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(repeat, latency, skip=()):
+    """Runs the benchmarks, returns the JSON report"""
+
+    rng = random.Random(BENCH_SEED)
+    results = {}
+    directory = tempfile.mkdtemp(prefix='iedlcde_bench')
+    try:
+        if 'packing' not in skip:
+            results.update(bench_packing(rng, repeat))
+        if 'firmware' not in skip:
+            results.update(bench_firmware(rng, repeat, directory))
+        if 'encoding' not in skip:
+            results.update(bench_encoding(rng, repeat * 10))
+        if 'preview' not in skip:
+            results.update(bench_preview(rng, repeat, latency))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        'version': __version__,
+        'commit': git_commit(),
+        'time': time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare(report, baseline):
+    """Prints the median of each benchmark against a baseline report
+
+    Returns True if none is slower than BENCH_REGRESSION times the baseline.
+    """
+
+    ok = True
+    for name, result in sorted(report['results'].items()):
+        old = baseline['results'].get(name)
+        if old is None:
+            print("{0:32} {1:10.6f} s".format(name, result['median']))
+            continue
+
+        ratio = result['median'] / old['median'] if old['median'] else 1
+        regression = ratio > BENCH_REGRESSION
+        ok = ok and not regression
+        print("{0:32} {1:10.6f} s {2:6.2f}x{3}".format(
+            name, result['median'], ratio, "  REGRESSION" if regression
+            else ""))
+
+    return ok
+
+
+def main(argv=None):
+    """Runs the benchmarks and saves the report"""
+
+    parser = argparse.ArgumentParser(
+        prog='iedlcde_bench', description="benchmark the LCD editor")
+    parser.add_argument(
+        '--out', default=None, help="JSON report to write")
+    parser.add_argument(
+        '--compare', default=None, help="JSON report to compare against")
+    parser.add_argument(
+        '--repeat', type=int, default=5, help="runs of each benchmark")
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help="seconds the emulated keyboard takes per command")
+    parser.add_argument(
+        '--skip', nargs='+', default=(),
+        choices=('packing', 'firmware', 'encoding', 'preview'),
+        help="benchmark groups not to run")
+    args = parser.parse_args(argv)
+
+    report = run(max(1, args.repeat), args.latency, args.skip)
+
+    if args.out is not None:
+        with open(args.out, 'w') as outfile:
+            json.dump(report, outfile, indent=2, sort_keys=True)
+
+    if args.compare is not None:
+        with open(args.compare) as infile:
+            return 0 if compare(report, json.load(infile)) else 1
+
+    for name, result in sorted(report['results'].items()):
+        print("{0:32} {1:10.6f} s".format(name, result['median']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
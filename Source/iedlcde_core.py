@@ -0,0 +1,2008 @@
+"""
+Infinity ErgoDox LCD Editor core, by LuX
+Image packing, firmware patching and the keyboard LCD protocol, without the
+GUI. Imports of Pillow, pyserial and the process pool are deferred until
+they are needed, so the module imports quickly and without a display.
+
+Code distributed "as is", use at your own risk
+"""
+
+import hashlib
+import mmap
+import os
+import queue
+import shutil
+import sys
+import threading
+import zlib
+from collections import OrderedDict, deque
+from time import perf_counter, sleep, time
+
+
+# GLOBALS
+__version__ = '0.9.1'
+__title__ = 'IED LCD Editor'
+__author__ = ['LuX', 'hymnis']
+__licence__ = 'MS-PL'
+
+# Default colors of the firmware (approximate)
+DEFAULT_COLORS = [6, 6, 6, 65, 15, 12, 30, 55, 20, 0, 50, 70,
+                  96, 64, 28, 72, 36, 52, 74, 71, 18, 1, 50, 34]
+
+# Firmware markers, the last byte of each marker is the first patched byte
+FUNCTIONS_MARKER = bytes(
+    [0xFC, 0xFC, 0xFC, 0xFC, 0xFC, 0xFC, 0xFC, 0xFC, 0xFC, 0xFC, 0xFC,
+     0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0x00, 0x00, 0x00])
+COLORS_MARKER = bytes(
+    [0xFC, 0xFC, 0xFC, 0xFC, 0xFC, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF,
+     0x00, 0x00, 0x00, 0x39, 0xB9, 0xEA, 0xAA, 0x8D, 0x8D])
+DEFAULTS_MARKER = b"Defaults to control."
+
+PATCH_MARKERS = (FUNCTIONS_MARKER, COLORS_MARKER, DEFAULTS_MARKER)
+PATCH_SKIP = (897, 42, 513)
+PATCH_INDEX = '.{0}.idx'  # cached marker offsets of a firmware file
+
+# DFU suffix: bcdDevice, idProduct, idVendor, bcdDFU, 'UFD', bLength, dwCRC
+DFU_SUFFIX_LENGTH = 16
+DFU_SIGNATURE = b'UFD'
+
+_INVERT = bytes(255 - i for i in range(256))
+
+# Serial settings
+IED_USB_ID = '1c11:b04d'
+PORT_SCAN_INTERVAL = 1.0  # seconds between port scans
+# Commands in flight before waiting for the keyboard. The CLI reads what
+# arrived into one line buffer and runs only its first line, so commands
+# are sent one at a time until pipelining is shown to work on a device
+SERIAL_WINDOW = 1
+SERIAL_PACED = False  # always use fixed sleeps instead of flow control
+SERIAL_TIMEOUTS = 3  # timeouts in a row before flow control is given up
+CLI_PROMPT = b'\x1b[1;32m:\x1b[0m '  # printed after every command
+LIVE_COLOR_RATE = 30  # max live color updates per second
+
+# LCD commands and the pacing they get without flow control
+LCD_INIT_COMMAND = b'lcdInit\r'
+LCD_INIT_DELAY = 0.1
+LCD_COLOR_DELAY = 0.05
+LCD_DISP_DELAY = 0.03
+
+_HEX = [hex(i).encode('ascii') for i in range(256)]
+
+# Theme files and how they are watched for changes
+THEME_FILES = ['F{0}.bmp'.format(n) for n in range(8)] + ['colors.txt']
+WATCH_INTERVAL = 0.5  # seconds between polls without inotify
+WATCH_SETTLE = 0.2  # seconds of quiet before changes are reported
+
+# Theme bundle: magic, version, 3 reserved bytes, payload length and
+# CRC-32, then the LCD data of the 8 slots and the 24 color values
+THEME_BUNDLE_MAGIC = b'IEDT'
+THEME_BUNDLE_VERSION = 1
+THEME_BUNDLE_HEADER = 16
+THEME_BUNDLE_EXT = '.iedt'
+THEME_SLOT_SIZES = [4 * (128 - 96 * min(1, n)) for n in range(8)]
+
+# Image import: conversion defaults and the cache of converted images
+IMPORT_DITHER = True  # Floyd-Steinberg, otherwise a threshold
+IMPORT_THRESHOLD = 128
+IMPORT_FIT = 'crop'  # or 'pad' to keep the whole image
+IMPORT_CACHE = '.iedlcde_cache'
+IMPORT_VERSION = 1  # changes the cache keys when conversion changes
+
+# Timing, off unless the variable is set (or --timing is given)
+TIMING_ENV = 'IEDLCDE_TIMING'
+PROFILE_ENV = 'IEDLCDE_PROFILE'  # stage to write cProfile output of
+
+
+# Timing #
+class Timings(object):
+    """Opt-in durations, counters and latency histograms of the I/O stages
+
+    Stages record how often they ran, their total and max seconds and a
+    histogram of power of two microsecond buckets. Counters hold bytes
+    written, commands sent and such. When `profile` names a stage it runs
+    under cProfile and the stats of its runs so far are written to
+    `<stage>.<pid>.prof`.
+    Disabled, a stage costs a flag check.
+    """
+
+    def __init__(self, enabled=False, profile=None):
+        self.enabled = enabled
+        self.profile = profile
+        self.profiler = None
+        self.profiling = False
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.counters = {}
+
+    def stage(self, name):
+        """Context manager timing a stage"""
+
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self, name)
+
+    def record(self, name, seconds):
+        """Adds a duration to a stage"""
+
+        bucket = 1 << max(0, int(seconds * 1e6)).bit_length()
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is None:
+                stage = self.stages[name] = {
+                    'count': 0, 'total': 0.0, 'max': 0.0, 'histogram': {}}
+            stage['count'] += 1
+            stage['total'] += seconds
+            stage['max'] = max(stage['max'], seconds)
+            stage['histogram'][bucket] = stage['histogram'].get(bucket, 0) + 1
+
+    def count(self, name, n=1):
+        """Adds to a counter"""
+
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        """Forgets everything recorded"""
+
+        with self.lock:
+            self.stages = {}
+            self.counters = {}
+
+    def take(self):
+        """Returns what was recorded and resets"""
+
+        with self.lock:
+            taken = (self.stages, self.counters)
+            self.stages = {}
+            self.counters = {}
+        return taken
+
+    def merge(self, taken):
+        """Adds what another Timings recorded, e.g. in a worker process"""
+
+        stages, counters = taken
+        with self.lock:
+            for name, other in stages.items():
+                stage = self.stages.setdefault(name, {
+                    'count': 0, 'total': 0.0, 'max': 0.0, 'histogram': {}})
+                stage['count'] += other['count']
+                stage['total'] += other['total']
+                stage['max'] = max(stage['max'], other['max'])
+                for bucket, n in other['histogram'].items():
+                    stage['histogram'][bucket] = \
+                        stage['histogram'].get(bucket, 0) + n
+            for name, n in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        """Returns the recordings as JSON data"""
+
+        with self.lock:
+            stages = {}
+            for name, stage in self.stages.items():
+                stages[name] = {
+                    'count': stage['count'],
+                    'total': stage['total'],
+                    'mean': stage['total'] / stage['count'],
+                    'max': stage['max'],
+                    'histogram_us': {
+                        '<{0}'.format(bucket): n for bucket, n in
+                        sorted(stage['histogram'].items())},
+                }
+            counters = dict(self.counters)
+
+        return {
+            'version': __version__,
+            'python': sys.version.split()[0],
+            'platform': sys.platform,
+            'stages': stages,
+            'counters': counters,
+        }
+
+    def summary(self):
+        """Returns the recordings as lines of text"""
+
+        report = self.report()
+        lines = []
+        for name, stage in sorted(report['stages'].items()):
+            lines.append("{0:20} {1:6} x {2:9.3f} ms, max {3:9.3f} ms".format(
+                name, stage['count'], stage['mean'] * 1000,
+                stage['max'] * 1000))
+        for name, n in sorted(report['counters'].items()):
+            lines.append("{0:20} {1}".format(name, n))
+
+        return lines
+
+    def dump(self, filename):
+        """Writes the recordings to a JSON file"""
+
+        import json
+
+        with open(filename, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+
+class _Stage(object):
+    """A running stage of a Timings"""
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+        self.profiler = None
+
+    def __enter__(self):
+        timings = self.timings
+        if timings.profile == self.name and not timings.profiling:
+            import cProfile
+
+            # One profiler per process, its stats add up over the runs
+            if timings.profiler is None:
+                timings.profiler = cProfile.Profile()
+            timings.profiling = True
+            self.profiler = timings.profiler
+            self.profiler.enable()
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = perf_counter() - self.start
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.timings.profiling = False
+            self.profiler.dump_stats('{0}.{1}.prof'.format(
+                self.name, os.getpid()))
+        self.timings.record(self.name, seconds)
+
+
+class _NoStage(object):
+    """Stage of a disabled Timings"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+TIMINGS = Timings(os.environ.get(TIMING_ENV, '0') not in ('', '0'),
+                  os.environ.get(PROFILE_ENV) or None)
+
+
+def timed_job(config, job, *args):
+    """Runs a job in a worker process with the timing config of the parent
+
+    Returns the result of the job and what it recorded, for pool_result().
+    """
+
+    TIMINGS.enabled, TIMINGS.profile = config
+    TIMINGS.reset()
+    return job(*args), TIMINGS.take()
+
+
+def pool_result(future):
+    """Returns the result of a timed_job() and merges its timings"""
+
+    result, taken = future.result()
+    TIMINGS.merge(taken)
+    return result
+
+
+def run_pool(jobs, job, describe, check=None, workers=None, pool=None):
+    """Runs job(*args) for every (name, args) of jobs in a process pool
+
+    Prints a line per job, in order: the name and describe(args, result),
+    or the error the job failed with. args may also be an exception a job
+    already failed with, it is reported without running the job. Returns
+    True if all jobs succeeded and check(result), if given, held for all.
+    """
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    if pool is None:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return run_pool(jobs, job, describe, check, pool=pool)
+
+    config = (TIMINGS.enabled, TIMINGS.profile)
+    futures = [None if isinstance(args, Exception) else
+               pool.submit(timed_job, config, job, *args)
+               for name, args in jobs]
+
+    success = True
+    for (name, args), future in zip(jobs, futures):
+        try:
+            if future is None:
+                raise args
+            result = pool_result(future)
+        except (IOError, OSError, ValueError) as e:
+            print("{0}: error: {1}".format(name, e))
+            success = False
+            continue
+
+        print("{0}: {1}".format(name, describe(args, result)))
+        success = success and (check is None or bool(check(result)))
+
+    return success
+
+
+# Themes #
+def load_image(filename, n):
+    """Loads the image of slot n in black-white format"""
+
+    from PIL import Image
+
+    with TIMINGS.stage('image.decode'):
+        image = Image.open(filename).convert("1")
+
+    if not image.width == 128 - 96 * min(1, n) or not image.height == 32:
+        raise ValueError(
+            "Image '{0}' is of wrong size\n"
+            "Should be:  {1} x 32\nImage is:  {2} x {3}".format(
+                filename, 128 - 96 * min(1, n),
+                image.width, image.height))
+
+    return image
+
+
+def pack_image(image):
+    """Transforms a 1-bit image into LCD acceptable data
+
+    The LCD takes 4 pages of 8 pixel rows, bottom page first, with the
+    lowest bit of each column byte being the bottom row of the page (pixel
+    (x, (3 - p) * 8 + 7 - z) is bit z of byte p * width + x). Transposing
+    the image makes every column a packed 4 byte row with the top pixel in
+    the highest bit, so the pages only need to be reordered and inverted.
+    """
+
+    from PIL import Image
+
+    with TIMINGS.stage('image.pack'):
+        imgwidth = image.width
+        columns = image.transpose(
+            Image.TRANSPOSE).tobytes().translate(_INVERT)
+
+        data = bytearray(4 * imgwidth)
+        for p in range(0, 4):
+            data[p * imgwidth:(p + 1) * imgwidth] = columns[3 - p::4]
+
+    return data
+
+
+def unpack_image(data):
+    """Transforms LCD data back into a 1-bit image"""
+
+    from PIL import Image
+
+    imgwidth = len(data) // 4
+
+    columns = bytearray(4 * imgwidth)
+    for p in range(0, 4):
+        columns[3 - p::4] = data[p * imgwidth:(p + 1) * imgwidth]
+
+    return Image.frombytes(
+        "1", (32, imgwidth), bytes(columns.translate(_INVERT))).transpose(
+        Image.TRANSPOSE)
+
+
+def load_colors(filename):
+    """Loads the 24 color values (0-100) from a colors file"""
+
+    colors = []
+    with open(filename) as f:
+        line_num = 0
+        for line in f:
+            line_num += 1
+            try:
+                colors.append(max(0, min(int(line), 100)))
+            except ValueError:
+                raise ValueError(
+                    "Invalid color in '{0}': '{1}', at line: {2}".format(
+                        filename, line.rstrip(), line_num))
+
+    if len(colors) != 24:
+        raise ValueError(
+            "Invalid number of colors in '{0}'\n"
+            "Make sure there are 24 lines of numbers in the file".format(
+                filename))
+
+    return colors
+
+
+def save_colors(filename, colors):
+    """Saves the 24 color values to a colors file"""
+
+    with open(filename, 'w') as cfile:
+        for color in colors:
+            cfile.write(str(color) + "\n")
+
+
+def load_theme(directory):
+    """Loads F0-F7.bmp and colors.txt from a theme directory
+
+    Returns the LCD data of the 8 images and the 24 color values. Theme
+    bundles are loaded too.
+    """
+
+    if os.path.isfile(directory):
+        return load_theme_bundle(directory)
+
+    images = []
+    for n in range(0, 8):
+        images.append(pack_image(
+            load_image(os.path.join(directory, "F{0}.bmp".format(n)), n)))
+
+    colors = load_colors(os.path.join(directory, "colors.txt"))
+
+    return images, colors
+
+
+def save_theme(directory, images, colors):
+    """Saves LCD data and colors as F0-F7.bmp and colors.txt"""
+
+    os.makedirs(directory, exist_ok=True)
+    for n in range(0, 8):
+        unpack_image(images[n]).save(
+            os.path.join(directory, "F{0}.bmp".format(n)))
+
+    save_colors(os.path.join(directory, "colors.txt"), colors)
+
+
+def save_theme_bundle(filename, images, colors):
+    """Saves LCD data and colors as a theme bundle file"""
+
+    for n in range(0, 8):
+        if len(images[n]) != THEME_SLOT_SIZES[n]:
+            raise ValueError("Image {0} is of wrong size".format(n))
+
+    payload = b''.join(bytes(images[n]) for n in range(0, 8)) + \
+        bytes(max(0, min(int(c), 100)) for c in colors[0:24])
+    header = THEME_BUNDLE_MAGIC + bytes([THEME_BUNDLE_VERSION, 0, 0, 0]) + \
+        len(payload).to_bytes(4, 'little') + \
+        zlib.crc32(payload).to_bytes(4, 'little')
+
+    write_atomic(filename, header + payload)
+
+
+def load_theme_bundle(filename):
+    """Loads the LCD data and colors of a theme bundle file
+
+    The file is mapped and checked, nothing needs decoding. Returns the LCD
+    data of the 8 images and the 24 color values.
+    """
+
+    with open(filename, 'rb') as infile:
+        data = map_file(infile)
+        try:
+            if len(data) < THEME_BUNDLE_HEADER or \
+                    data[0:4] != THEME_BUNDLE_MAGIC:
+                raise ValueError(
+                    "'{0}' is not a theme bundle".format(filename))
+            if data[4] != THEME_BUNDLE_VERSION:
+                raise ValueError(
+                    "Theme bundle '{0}' is of an unknown version {1}".format(
+                        filename, data[4]))
+
+            length = int.from_bytes(data[8:12], 'little')
+            payload = data[THEME_BUNDLE_HEADER:THEME_BUNDLE_HEADER + length]
+            if length != sum(THEME_SLOT_SIZES) + 24 or \
+                    len(payload) != length or \
+                    zlib.crc32(payload) != int.from_bytes(
+                        data[12:16], 'little'):
+                raise ValueError(
+                    "Theme bundle '{0}' is damaged".format(filename))
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    images = []
+    pos = 0
+    for size in THEME_SLOT_SIZES:
+        images.append(bytearray(payload[pos:pos + size]))
+        pos += size
+
+    return images, list(payload[pos:pos + 24])
+
+
+class ThemeLibrary(object):
+    """Directory of theme bundles
+
+    Loaded bundles are kept until their file changes, so switching between
+    themes already seen only costs a stat.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.cache = {}
+
+    def names(self):
+        """Returns the names of the themes, sorted"""
+
+        try:
+            return sorted(
+                entry.name[:-len(THEME_BUNDLE_EXT)]
+                for entry in os.scandir(self.directory)
+                if entry.name.endswith(THEME_BUNDLE_EXT) and entry.is_file())
+        except (IOError, OSError):
+            return []
+
+    def path(self, name):
+        return os.path.join(self.directory, name + THEME_BUNDLE_EXT)
+
+    def load(self, name):
+        """Returns the LCD data and colors of a theme"""
+
+        filename = self.path(name)
+        signature = file_signature(filename)
+        cached = self.cache.get(name)
+        if cached is None or cached[0] != signature or signature is None:
+            cached = self.cache[name] = (
+                signature, load_theme_bundle(filename))
+
+        images, colors = cached[1]
+        return [bytearray(image) for image in images], list(colors)
+
+    def save(self, name, images, colors):
+        """Stores a theme in the library"""
+
+        if not name or os.path.basename(name) != name:
+            raise ValueError("Invalid theme name '{0}'".format(name))
+
+        os.makedirs(self.directory, exist_ok=True)
+        save_theme_bundle(self.path(name), images, colors)
+        self.cache.pop(name, None)
+
+
+def load_animation(path):
+    """Loads the 128 x 32 frames of an animated image or a directory
+
+    Returns the LCD data of every frame, directories are read in file name
+    order.
+    """
+
+    from PIL import Image, ImageSequence
+
+    if os.path.isdir(path):
+        images = []
+        for name in sorted(os.listdir(path)):
+            filename = os.path.join(path, name)
+            if os.path.isfile(filename):
+                images.append(Image.open(filename))
+    else:
+        images = [Image.open(path)]
+
+    frames = []
+    for image in images:
+        for frame in ImageSequence.Iterator(image):
+            if frame.width != 128 or frame.height != 32:
+                raise ValueError(
+                    "Frame of '{0}' is of wrong size\n"
+                    "Should be:  128 x 32\nFrame is:  {1} x {2}".format(
+                        image.filename, frame.width, frame.height))
+            frames.append(pack_image(frame.convert("1")))
+
+    return frames
+
+
+def convert_image(image, n, dither=IMPORT_DITHER,
+                  threshold=IMPORT_THRESHOLD, fit=IMPORT_FIT):
+    """Converts any image to a 1-bit image of the size of slot n
+
+    The image is cropped to the slot's aspect ratio and scaled ('crop'), or
+    scaled to fit and padded with white ('pad'), then Floyd-Steinberg
+    dithered or thresholded. Images already of the slot size are only
+    converted, which gives the same result as load_image().
+    """
+
+    from PIL import Image, ImageOps
+
+    size = (128 - 96 * min(1, n), 32)
+
+    # Transparent parts are white
+    if image.mode in ('RGBA', 'LA', 'PA') or \
+            (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGBA', image.size, 'white')
+        background.alpha_composite(image)
+        image = background.convert('RGB')
+
+    if image.size != size:
+        if image.mode not in ('L', 'RGB'):
+            image = image.convert('RGB')
+
+        if fit == 'pad':
+            scale = min(size[0] / image.width, size[1] / image.height)
+            scaled = image.resize(
+                (max(1, round(image.width * scale)),
+                 max(1, round(image.height * scale))), Image.LANCZOS)
+            image = Image.new(image.mode, size, 'white')
+            image.paste(scaled, ((size[0] - scaled.width) // 2,
+                                 (size[1] - scaled.height) // 2))
+        else:
+            image = ImageOps.fit(image, size, Image.LANCZOS)
+
+    if image.mode == '1':
+        return image
+    if dither:
+        return image.convert('1', dither=Image.FLOYDSTEINBERG)
+    return image.convert('L').point(
+        [255 if v >= threshold else 0 for v in range(256)], '1')
+
+
+def import_image(filename, n, dither=IMPORT_DITHER,
+                 threshold=IMPORT_THRESHOLD, fit=IMPORT_FIT,
+                 cache=IMPORT_CACHE):
+    """Loads any image as LCD data of slot n, see convert_image()
+
+    Images of other sizes than the slot are cached in the cache directory,
+    keyed by the file contents and the conversion, so they are converted
+    only once. No cache is used if cache is None.
+    """
+
+    import io
+
+    from PIL import Image
+
+    with open(filename, 'rb') as f:
+        content = f.read()
+
+    # Only reads the header, the size is known before decoding
+    try:
+        image = Image.open(io.BytesIO(content))
+    except (IOError, OSError):
+        raise ValueError("'{0}' is not an image".format(filename))
+
+    key = None
+    if cache is not None and image.size != (128 - 96 * min(1, n), 32):
+        key = hashlib.sha1(content + '|{0}|{1}|{2}|{3}|{4}'.format(
+            IMPORT_VERSION, 128 - 96 * min(1, n), bool(dither),
+            threshold, fit).encode('ascii')).hexdigest()
+        try:
+            with open(os.path.join(cache, key), 'rb') as f:
+                data = bytearray(f.read())
+            if len(data) == THEME_SLOT_SIZES[n]:
+                if TIMINGS.enabled:
+                    TIMINGS.count('import.cached')
+                return data
+        except (IOError, OSError):
+            pass
+
+    with TIMINGS.stage('image.import'):
+        data = pack_image(convert_image(image, n, dither, threshold, fit))
+
+    if key is not None:
+        try:
+            os.makedirs(cache, exist_ok=True)
+            write_atomic(os.path.join(cache, key), data)
+        except (IOError, OSError):
+            pass
+
+    return data
+
+
+def write_atomic(filename, data):
+    """Writes a file through a temporary file of this process
+
+    Readers, like a library view or other workers, never see the file half
+    written. The temporary file is removed if writing fails.
+    """
+
+    temp_file = '{0}.{1}'.format(filename, os.getpid())
+    try:
+        with open(temp_file, 'wb') as f:
+            f.write(data)
+        os.replace(temp_file, filename)
+    except BaseException:
+        try:
+            os.remove(temp_file)
+        except OSError:
+            pass
+        raise
+
+
+def file_signature(filename):
+    """Returns what tells a file changed (mtime, size, inode), or None"""
+
+    try:
+        stat = os.stat(filename)
+    except (IOError, OSError):
+        return None
+
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class ThemeWatcher(object):
+    """Watches the THEME_FILES of a directory on a background thread
+
+    Uses inotify where it is available and polls the files otherwise. Either
+    way the signatures of the files are compared once things have been
+    quiet for WATCH_SETTLE, so `changed` is only called with the names of
+    files that really changed, once per save however the editor writes.
+    It is called from the watcher thread.
+    """
+
+    def __init__(self, directory, changed, interval=WATCH_INTERVAL,
+                 use_inotify=True):
+        self.directory = directory
+        self.changed = changed
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.signatures = {}
+        self.stopped = threading.Event()
+
+        for name in THEME_FILES:
+            self.refresh(name)
+
+        self.inotify = _Inotify.open(directory) if use_inotify else None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def refresh(self, name):
+        """Takes the current state of a file as seen, e.g. after saving it"""
+
+        with self.lock:
+            self.signatures[name] = file_signature(
+                os.path.join(self.directory, name))
+
+    def scan(self):
+        """Returns the names of the files changed since the last scan"""
+
+        changed = []
+        with self.lock:
+            for name in THEME_FILES:
+                signature = file_signature(os.path.join(self.directory, name))
+                if signature != self.signatures.get(name):
+                    self.signatures[name] = signature
+                    if signature is not None:
+                        changed.append(name)
+
+        return changed
+
+    def stop(self):
+        """Stops watching"""
+
+        self.stopped.set()
+
+    def _run(self):
+        """Watcher thread main loop"""
+
+        try:
+            while not self.stopped.is_set():
+                if self.inotify is not None:
+                    if not self.inotify.wait(self.interval, THEME_FILES):
+                        continue
+                    # Let the editor finish writing
+                    while self.inotify.wait(WATCH_SETTLE, THEME_FILES):
+                        pass
+                elif self.stopped.wait(self.interval):
+                    break
+
+                changed = self.scan()
+                if changed and not self.stopped.is_set():
+                    self.changed(changed)
+        finally:
+            if self.inotify is not None:
+                self.inotify.close()
+
+
+class _Inotify(object):
+    """Linux inotify watch of a directory, through ctypes"""
+
+    IN_MODIFY = 0x002
+    IN_ATTRIB = 0x004
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_CLOEXEC = 0o2000000
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    @classmethod
+    def open(cls, directory):
+        """Returns a watch of the directory, or None without inotify"""
+
+        if not sys.platform.startswith('linux'):
+            return None
+
+        try:
+            import ctypes
+
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(cls.IN_CLOEXEC)
+            if fd < 0:
+                return None
+            if libc.inotify_add_watch(
+                    fd, os.fsencode(directory), cls.MASK) < 0:
+                os.close(fd)
+                return None
+        except (AttributeError, OSError):
+            return None
+
+        return cls(fd)
+
+    def wait(self, timeout, names):
+        """Waits for events, tells if one of them was about a named file"""
+
+        import select
+
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return False
+
+        data = os.read(self.fd, 65536)
+        pos = 0
+        found = False
+        while pos + 16 <= len(data):
+            length = int.from_bytes(data[pos + 12:pos + 16], sys.byteorder)
+            name = data[pos + 16:pos + 16 + length].rstrip(b'\0')
+            found = found or os.fsdecode(name) in names
+            pos += 16 + length
+
+        return found
+
+    def close(self):
+        os.close(self.fd)
+
+
+# Firmware #
+def build_patches(images, colors):
+    """Returns the replacement data for each of the PATCH_MARKERS"""
+
+    functions = b''.join([bytes(2)] + [images[i] for i in range(1, 8)])
+
+    color_words = bytearray([0x8D])
+    for col in range(1, 8):
+        for chan in range(0, 3):
+            value = int(655.35 * colors[col * 3 + chan])
+            color_words.append(value & 0xFF)
+            color_words.append(value >> 8)
+
+    defaults = b"." + bytes(1) + images[0]
+
+    return functions, bytes(color_words), defaults
+
+
+def find_patches(data):
+    """Finds the PATCH_MARKERS in firmware data
+
+    Returns a list of (marker index, offset of the first patched byte) in
+    file order. Markers are matched like a byte stream in which the skipped
+    region of a patch is not seen, exactly like the original per-byte scan.
+    """
+
+    found = []
+    remaining = list(range(len(PATCH_MARKERS)))
+    carry = max(len(m) for m in PATCH_MARKERS) - 1
+    tail = b''
+    pos = 0
+    size = len(data)
+
+    # Last find of each marker, still valid while it is past pos, and for
+    # good if the marker wasn't found, so each one is scanned for once
+    hits = {}
+
+    while remaining:
+        # Markers that straddle the end of the previous patch
+        bridge = tail + data[pos:pos + carry]
+
+        best = None
+        for n in remaining:
+            marker = PATCH_MARKERS[n]
+            end = None
+
+            i = bridge.find(marker)
+            if i >= 0:
+                end = pos + i + len(marker) - len(tail)
+            else:
+                i = hits.get(n)
+                if i is None or 0 <= i < pos:
+                    i = hits[n] = data.find(marker, pos)
+                if i >= 0:
+                    end = i + len(marker)
+
+            if end is not None and (best is None or end < best[1]):
+                best = (n, end)
+
+        if best is None:
+            break
+
+        n, end = best
+        remaining.remove(n)
+        found.append((n, end - 1))
+
+        tail = (tail + data[max(pos, end - carry):end])[-carry:]
+        pos = min(end + PATCH_SKIP[n], size)
+
+    return found
+
+
+def read_patches(data):
+    """Reads the images and colors back out of patched firmware data
+
+    Returns the LCD data of the 8 images and the 24 color values. Slot 0
+    colors aren't stored in the firmware, DEFAULT_COLORS are used for them.
+    """
+
+    regions = {}
+    for n, offset in find_patches(data):
+        regions[n] = data[offset:offset + 1 + PATCH_SKIP[n]]
+
+    if len(regions) != len(PATCH_MARKERS) or \
+            any(len(regions[n]) != 1 + PATCH_SKIP[n] for n in regions):
+        raise ValueError("LCD data not found")
+
+    functions, color_words, defaults = (regions[n] for n in range(0, 3))
+
+    images = [bytearray(defaults[2:])]
+    for i in range(0, 7):
+        images.append(bytearray(functions[2 + i * 128:2 + (i + 1) * 128]))
+
+    # Color words are stored low byte first
+    colors = DEFAULT_COLORS[0:3]
+    for w in range(0, 21):
+        value = color_words[1 + w * 2] | (color_words[2 + w * 2] << 8)
+        colors.append(int(round(value / 655.35)))
+
+    return images, colors
+
+
+def has_dfu_suffix(data):
+    """Tells if firmware data ends with a DFU suffix"""
+
+    return len(data) >= DFU_SUFFIX_LENGTH and \
+        data[-8:-5] == DFU_SIGNATURE and data[-5] == DFU_SUFFIX_LENGTH
+
+
+def dfu_crc(data, crc=0xFFFFFFFF):
+    """Computes the DFU CRC of data, continuing from a previous crc
+
+    DFU uses CRC-32 without the final inversion zlib.crc32 does.
+    """
+
+    return zlib.crc32(data, crc ^ 0xFFFFFFFF) ^ 0xFFFFFFFF
+
+
+def _gf2_times(matrix, vector):
+    """Multiplies a GF(2) matrix by a vector"""
+
+    result = 0
+    i = 0
+    while vector:
+        if vector & 1:
+            result ^= matrix[i]
+        vector >>= 1
+        i += 1
+
+    return result
+
+
+def _gf2_square(matrix):
+    """Squares a GF(2) matrix"""
+
+    return [_gf2_times(matrix, matrix[n]) for n in range(32)]
+
+
+# Operators advancing a CRC register over 2 ** n zero bytes, see crc_zeros()
+_CRC_ZERO_OPERATORS = []
+
+
+def crc_zeros(crc, length):
+    """Advances a CRC register over length zero bytes in O(log(length))
+
+    Same as zlib's crc32_combine, only the register is advanced. The
+    operators are computed once, as longer lengths first need them.
+    """
+
+    global _CRC_ZERO_OPERATORS
+
+    operators = _CRC_ZERO_OPERATORS
+    if len(operators) < length.bit_length():
+        if operators:
+            operators = list(operators)
+        else:
+            # Operator for one zero bit, squared into one for a zero byte
+            operator = [0xEDB88320] + [1 << n for n in range(31)]
+            for k in range(3):
+                operator = _gf2_square(operator)
+            operators = [operator]
+
+        while len(operators) < length.bit_length():
+            operators.append(_gf2_square(operators[-1]))
+
+        # Replaced, not extended, as other threads may be reading it
+        _CRC_ZERO_OPERATORS = operators
+
+    n = 0
+    while length:
+        if length & 1:
+            crc = _gf2_times(operators[n], crc)
+        length >>= 1
+        n += 1
+
+    return crc
+
+
+def dfu_crc_replace(crc, length, offset, old, new):
+    """Updates the DFU CRC of length bytes when old at offset becomes new
+
+    CRCs are linear, so only the difference of the region is needed.
+    """
+
+    difference = (int.from_bytes(old, 'big') ^ int.from_bytes(new, 'big'))
+    difference = difference.to_bytes(len(new), 'big')
+
+    change = zlib.crc32(difference, 0xFFFFFFFF) ^ 0xFFFFFFFF
+    return crc ^ crc_zeros(change, length - offset - len(new))
+
+
+class DFUWriter(object):
+    """File writer that keeps the DFU CRC of what it writes
+
+    The last DFU_SUFFIX_LENGTH bytes are held back, so the suffix can be
+    checked and its CRC filled in by close().
+    """
+
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.crc = 0xFFFFFFFF
+        self.held = b''
+
+    def write(self, data):
+        data = self.held + data
+        cut = max(0, len(data) - DFU_SUFFIX_LENGTH)
+        self.crc = dfu_crc(data[:cut], self.crc)
+        self.outfile.write(data[:cut])
+        self.held = data[cut:]
+
+    def close(self):
+        """Writes the held back data, returns True if the CRC was set"""
+
+        suffix = self.held
+        fixed = has_dfu_suffix(suffix)
+        if fixed:
+            crc = dfu_crc(suffix[:-4], self.crc)
+            suffix = suffix[:-4] + crc.to_bytes(4, 'little')
+
+        self.outfile.write(suffix)
+        self.held = b''
+
+        return fixed
+
+
+def find_patches_cached(infile, data):
+    """Finds the PATCH_MARKERS of an open firmware file using its index
+
+    The offsets are kept in a PATCH_INDEX file next to the firmware, keyed
+    by its size, mtime and SHA-1. The content hash is only computed when the
+    size or mtime changed, so an unchanged file is never scanned again.
+
+    Returns the offsets and the DFU CRC the file should have, or None if it
+    has no DFU suffix.
+    """
+
+    import json
+
+    filename = os.path.abspath(infile.name)
+    index_file = os.path.join(
+        os.path.dirname(filename),
+        PATCH_INDEX.format(os.path.basename(filename)))
+    stat = os.fstat(infile.fileno())
+
+    try:
+        with open(index_file) as f:
+            index = json.load(f)
+        if index['size'] != stat.st_size or \
+                index['skip'] != list(PATCH_SKIP) or 'crc' not in index:
+            index = None
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        index = None
+
+    if index is not None and index['mtime'] == stat.st_mtime_ns:
+        return [tuple(found) for found in index['patches']], index['crc']
+
+    digest = hashlib.sha1(data).hexdigest()
+    if index is not None and index['sha1'] == digest:
+        found = [tuple(found) for found in index['patches']]
+        crc = index['crc']
+    else:
+        found = find_patches(data)
+        crc = None
+        if has_dfu_suffix(data):
+            with memoryview(data) as view:
+                crc = dfu_crc(view[:-4])
+
+    # A file changed within the mtime resolution may change again unseen,
+    # so like git only its hash is trusted until it is a little older
+    mtime = stat.st_mtime_ns
+    if time() - mtime / 1e9 < 2:
+        mtime = None
+
+    index = {
+        'size': stat.st_size,
+        'mtime': mtime,
+        'sha1': digest,
+        'skip': list(PATCH_SKIP),
+        'patches': found,
+        'crc': crc,
+    }
+
+    try:
+        write_atomic(index_file, json.dumps(index).encode('ascii'))
+    except (IOError, OSError):
+        pass
+
+    return found, crc
+
+
+def patch_firmware(data, outfile, patches, found=None):
+    """Writes firmware data to outfile with the given patches applied
+
+    found are the offsets from find_patches(), searched for if not given.
+    Returns a list of booleans telling which patches were written.
+    """
+
+    if found is None:
+        found = find_patches(data)
+
+    saved = [False] * len(PATCH_MARKERS)
+    pos = 0
+    size = len(data)
+
+    for n, offset in found:
+        outfile.write(data[pos:offset])
+        outfile.write(patches[n])
+        saved[n] = True
+        pos = min(offset + 1 + PATCH_SKIP[n], size)
+
+    outfile.write(data[pos:])
+
+    return saved
+
+
+def map_file(infile):
+    """Returns a read-only mapping (or the contents) of an open file"""
+
+    try:
+        return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # Empty files can't be mapped
+        return infile.read()
+
+
+# Serial #
+class SerialTransport(object):
+    """Sends CLI commands to the keyboard with flow control
+
+    Every command the keyboard finishes is followed by a CLI prompt, so up
+    to `window` commands are written before waiting for prompts to come
+    back. If the keyboard does not answer within the port timeout the
+    transport falls back to the fixed sleeps of the old pacing for the rest
+    of the commands, and tries flow control again on the next ones unless
+    that happened SERIAL_TIMEOUTS times in a row.
+    """
+
+    def __init__(self, ser, window=SERIAL_WINDOW, paced=SERIAL_PACED):
+        self.ser = ser
+        self.window = max(1, window)
+        self.always_paced = paced
+        self.paced = paced
+        self.timeouts = 0
+        self.in_flight = 0
+        self.received = b''
+        self.bytes_sent = 0
+        self.sent_times = deque()  # of the commands in flight, when timed
+
+    def send(self, command, delay=0):
+        """Sends a command, delay is the pacing used without flow control"""
+
+        self.send_spans(command, [(0, len(command))], [delay])
+
+    def send_spans(self, buffer, spans, delays, cancel=None):
+        """Sends the commands found at (start, end) spans of a buffer
+
+        Runs of adjacent commands are sent in one write, as many as flow
+        control allows. Returns the number of commands sent, which is less
+        than all of them if cancelled.
+        """
+
+        view = memoryview(buffer)
+        sent = 0
+
+        if not self.always_paced and self.timeouts < SERIAL_TIMEOUTS:
+            self.paced = False
+
+        while sent < len(spans):
+            if cancel is not None and cancel.is_set():
+                break
+
+            while self.in_flight >= self.window and not self.paced:
+                self._read_prompts(True)
+
+            if self.paced:
+                start, end = spans[sent]
+                self._write(view[start:end], 1)
+                with TIMINGS.stage('serial.sleep'):
+                    sleep(delays[sent])
+                sent += 1
+                continue
+
+            count = 1
+            while count < self.window - self.in_flight and \
+                    sent + count < len(spans) and \
+                    spans[sent + count][0] == spans[sent + count - 1][1]:
+                count += 1
+
+            start, end = spans[sent][0], spans[sent + count - 1][1]
+            self._write(view[start:end], count)
+            self.in_flight += count
+            sent += count
+            self._read_prompts(False)
+
+        return sent
+
+    def _write(self, data, commands):
+        """Writes commands to the port"""
+
+        if TIMINGS.enabled:
+            with TIMINGS.stage('serial.write'):
+                self.ser.write(data)
+            TIMINGS.count('serial.commands', commands)
+            TIMINGS.count('serial.bytes', len(data))
+            if not self.paced:
+                self.sent_times.extend([perf_counter()] * commands)
+        else:
+            self.ser.write(data)
+        self.bytes_sent += len(data)
+
+    def flush(self):
+        """Waits until the keyboard has handled every command sent"""
+
+        while self.in_flight > 0 and not self.paced:
+            self._read_prompts(True)
+
+    def _read_prompts(self, wait):
+        """Reads the keyboard output and counts the prompts in it"""
+
+        waiting = self.ser.in_waiting
+        if waiting == 0:
+            if not wait:
+                return
+
+            # Port timeout, the keyboard isn't sending prompts back
+            data = self.ser.read(1)
+            if data == b'':
+                self.paced = True
+                self.timeouts += 1
+                self.in_flight = 0
+                self.sent_times.clear()
+                return
+            waiting = self.ser.in_waiting
+            data += self.ser.read(waiting) if waiting else b''
+        else:
+            data = self.ser.read(waiting)
+
+        self.received += data
+        prompts = self.received.count(CLI_PROMPT)
+        if prompts:
+            self.timeouts = 0
+            self.in_flight = max(0, self.in_flight - prompts)
+            now = perf_counter()
+            for k in range(min(prompts, len(self.sent_times))):
+                TIMINGS.record('serial.latency',
+                               now - self.sent_times.popleft())
+            self.received = self.received[
+                self.received.rindex(CLI_PROMPT) + len(CLI_PROMPT):]
+        self.received = self.received[-(len(CLI_PROMPT) - 1):]
+
+
+class LCDShadow(object):
+    """Last framebuffer and backlight color sent to a keyboard"""
+
+    def __init__(self):
+        self.frame = None
+        self.color = None
+
+    def invalidate(self):
+        """Forgets the LCD state, e.g. after an error or reconnecting"""
+
+        self.frame = None
+        self.color = None
+
+
+def lcd_frame(data):
+    """Places the LCD data of a slot into a full 128 x 32 framebuffer"""
+
+    width = len(data) // 4
+    if width == 128:
+        return bytearray(data)
+
+    frame = bytearray(4 * 128)
+    for p in range(0, 4):
+        frame[p * 128:p * 128 + width] = data[p * width:(p + 1) * width]
+
+    return frame
+
+
+def lcd_color_command(color):
+    """Encodes an lcdColor command"""
+
+    return b'lcdColor ' + b' '.join(
+        str(c).encode('ascii') for c in color) + b' \r'
+
+
+def lcd_disp_command(page, column, data):
+    """Encodes an lcdDisp command for the columns of a page"""
+
+    return b'lcdDisp ' + _HEX[page] + b' ' + _HEX[column] + b' ' + \
+        b' '.join([_HEX[b] for b in data]) + b' \r'
+
+
+class LCDUpload(object):
+    """Commands that show a framebuffer and color, compiled once
+
+    The buffer holds lcdInit, lcdColor and the 32 lcdDisp commands of the
+    16 column segments; spans has the (start, end) of each command in it and
+    segments the framebuffer offset of each lcdDisp.
+    """
+
+    def __init__(self, color, frame):
+        self.color = color
+        self.frame = bytes(frame)
+
+        commands = [LCD_INIT_COMMAND, lcd_color_command(color)]
+        self.segments = []
+        for segment in range(8):
+            for z in range(0, 4):
+                start = z * 128 + segment * 16
+                commands.append(lcd_disp_command(
+                    z, segment * 16, self.frame[start:start + 16]))
+                self.segments.append(start)
+
+        self.buffer = b''.join(commands)
+        self.spans = []
+        pos = 0
+        for command in commands:
+            self.spans.append((pos, pos + len(command)))
+            pos += len(command)
+
+
+class SerialWorker(object):
+    """Runs serial jobs on a background thread
+
+    A new job replaces a pending job with the same key and cancels it if it
+    is already running. Jobs get a cancel event to check, and their results
+    are queued as (done, result, error) for the GUI thread to collect and
+    call done(result, error) with. Workers can share one results queue.
+    """
+
+    def __init__(self, results=None):
+        self.lock = threading.Condition()
+        self.pending = OrderedDict()
+        self.running = None
+        self.results = queue.Queue() if results is None else results
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, key, job, done=None):
+        """Queues job(cancel), done is queued with its result when it
+        finishes"""
+
+        with self.lock:
+            self.pending[key] = (job, done)
+            if self.running is not None and self.running[0] == key:
+                self.running[1].set()
+            self.lock.notify()
+
+    def cancel(self, key):
+        """Drops the pending job with a key and cancels its running job"""
+
+        with self.lock:
+            self.pending.pop(key, None)
+            if self.running is not None and self.running[0] == key:
+                self.running[1].set()
+
+    def _run(self):
+        """Worker thread main loop"""
+
+        while True:
+            with self.lock:
+                while not self.pending:
+                    self.lock.wait()
+                key, (job, done) = self.pending.popitem(last=False)
+                cancel = threading.Event()
+                self.running = (key, cancel)
+
+            result = None
+            error = None
+            try:
+                result = job(cancel)
+            except Exception as e:
+                error = e
+
+            with self.lock:
+                self.running = None
+
+            if done is not None:
+                self.results.put((done, result, error))
+
+
+class SerialSession(object):
+    """Keyboard connection that stays open between actions
+
+    Holds the port, its transport and the LCD shadow of the keyboard. The
+    methods are only used from the serial worker thread.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.ser = None
+        self.transport = None
+        self.shadow = LCDShadow()
+        self.color_sent = 0
+
+    @property
+    def connected(self):
+        return self.ser is not None and self.ser.is_open
+
+    def open(self):
+        """Opens the port unless it is already open"""
+
+        import serial
+
+        if self.connected:
+            return
+
+        ser = serial.Serial()
+        ser.baudrate = 115200
+        ser.timeout = 0.5
+        ser.port = self.port
+        ser.open()
+        ser.reset_input_buffer()
+
+        self.ser = ser
+        self.transport = SerialTransport(ser)
+        self.shadow.invalidate()
+
+    def close(self):
+        """Closes the port, the LCD state is unknown afterwards"""
+
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except (IOError, OSError):
+                pass
+
+        self.ser = None
+        self.transport = None
+        self.shadow.invalidate()
+
+    def clear_shadow(self):
+        """Sets the LCD shadow to a cleared LCD"""
+
+        self.shadow.frame = bytearray(4 * 128)
+        self.shadow.color = None
+
+    def set_lcd_color(self, color):
+        """Sets the color of the screen, unless it is already set"""
+
+        if color == self.shadow.color:
+            return
+
+        self.transport.send(lcd_color_command(color), LCD_COLOR_DELAY)
+        self.shadow.color = color
+
+    def upload(self, upload, cancel=None):
+        """Sends the parts of a compiled upload the LCD doesn't show yet
+
+        Returns False if cancelled before everything was sent.
+        """
+
+        shown = self.shadow.frame
+        color = self.shadow.color
+        frame = upload.frame
+        spans = []
+        delays = []
+        changes = []
+
+        # Only clear the LCD when its content is unknown
+        if shown is None:
+            shown = bytes(4 * 128)
+            color = None
+            spans.append(upload.spans[0])
+            delays.append(LCD_INIT_DELAY)
+            changes.append(None)
+
+        if upload.color != color:
+            spans.append(upload.spans[1])
+            delays.append(LCD_COLOR_DELAY)
+            changes.append(-1)
+
+        for k, start in enumerate(upload.segments):
+            if shown[start:start + 16] != frame[start:start + 16]:
+                spans.append(upload.spans[2 + k])
+                delays.append(LCD_DISP_DELAY)
+                changes.append(start)
+
+        sent = self.transport.send_spans(upload.buffer, spans, delays, cancel)
+
+        # Remember what the LCD shows now
+        for start in changes[:sent]:
+            if start is None:
+                self.clear_shadow()
+            elif start < 0:
+                self.shadow.color = upload.color
+            else:
+                self.shadow.frame[start:start + 16] = frame[start:start + 16]
+
+        return sent == len(spans)
+
+    def preview(self, upload, cancel):
+        """Shows a compiled upload on the LCD"""
+
+        with TIMINGS.stage('lcd.preview'):
+            self.open()
+            try:
+                self.upload(upload, cancel)
+                self.transport.flush()
+            except (IOError, OSError):
+                self.close()
+                raise
+
+    def animate(self, frames, color, fps, loops=1, cancel=None):
+        """Streams frames to the LCD at a target frame rate
+
+        Frames that are already late are dropped. Returns the frames shown,
+        frames dropped, seconds taken and bytes sent.
+        """
+
+        if not 0 < fps < float('inf'):
+            raise ValueError("The frame rate must be above 0")
+
+        uploads = [LCDUpload(color, frame) for frame in frames]
+        total = len(uploads) * loops
+        shown = 0
+        dropped = 0
+
+        self.open()
+        try:
+            sent = self.transport.bytes_sent
+            start = time()
+            k = 0
+            while k < total:
+                if cancel is not None and cancel.is_set():
+                    break
+
+                # Skip to the frame that should be showing by now
+                due = int((time() - start) * fps)
+                if due > k:
+                    dropped += min(due, total) - k
+                    k = due
+                    if k >= total:
+                        break
+
+                wait = start + k / fps - time()
+                if wait > 0:
+                    sleep(wait)
+
+                self.upload(uploads[k % len(uploads)])
+                shown += 1
+                k += 1
+
+            self.transport.flush()
+            elapsed = time() - start
+            sent = self.transport.bytes_sent - sent
+        except (IOError, OSError):
+            self.close()
+            raise
+
+        return shown, dropped, elapsed, sent
+
+    def stream_color(self, color, cancel):
+        """Sets a live color, at most LIVE_COLOR_RATE times a second"""
+
+        if cancel.wait(self.color_sent + 1 / LIVE_COLOR_RATE - time()):
+            return
+
+        with TIMINGS.stage('lcd.color'):
+            self.open()
+            try:
+                self.set_lcd_color(color)
+                self.transport.flush()
+            except (IOError, OSError):
+                self.close()
+                raise
+            finally:
+                self.color_sent = time()
+
+
+class PortMonitor(object):
+    """Polls the keyboard serial ports on a background thread
+
+    The latest scan is kept in `ports`, a new list after every scan.
+    """
+
+    def __init__(self, interval=PORT_SCAN_INTERVAL):
+        self.interval = interval
+        self.ports = []
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def find_ports():
+        """Returns the keyboard serial ports"""
+
+        from serial.tools import list_ports
+
+        port_list = []
+        with TIMINGS.stage('ports.scan'):
+            for port_no, description, address in list_ports.grep(
+                    IED_USB_ID):
+                port_list.append(port_no)
+
+        return sorted(port_list)
+
+    def scan(self):
+        """Scans the ports now and returns them"""
+
+        self.ports = self.find_ports()
+        return self.ports
+
+    def _run(self):
+        """Monitor thread main loop"""
+
+        while True:
+            try:
+                self.scan()
+            except (IOError, OSError):
+                pass
+            sleep(self.interval)
+
+
+# Batch #
+def firmware_files(paths):
+    """Returns firmware files, with directories replaced by the .dfu.bin
+    files in them"""
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+                if name.endswith('.dfu.bin') and
+                os.path.isfile(os.path.join(path, name)))
+        else:
+            files.append(path)
+
+    return files
+
+
+def write_patches(output, patches, found, crc=None):
+    """Writes patches in place into a copy of the firmware
+
+    crc is the new DFU CRC, written to the DFU suffix if given.
+    """
+
+    with open(output, 'r+b') as outfile:
+        fd = outfile.fileno()
+        writes = [(patches[n], offset) for n, offset in found]
+        if crc is not None:
+            writes.append((crc.to_bytes(4, 'little'),
+                           os.fstat(fd).st_size - 4))
+
+        for data, offset in writes:
+            if hasattr(os, 'pwrite'):
+                os.pwrite(fd, data, offset)
+            else:
+                outfile.seek(offset)
+                outfile.write(data)
+
+
+def build_firmware(firmware, output, patches):
+    """Writes a patched copy of a firmware file, returns the saved flags
+
+    When every patch fits in the file the copy is made by the OS and only
+    the patched regions and DFU CRC are written, otherwise the file is
+    streamed through a DFUWriter.
+    """
+
+    with open(firmware, 'rb') as infile:
+        data = map_file(infile)
+        try:
+            with TIMINGS.stage('firmware.scan'):
+                found, crc = find_patches_cached(infile, data)
+            limit = len(data)
+            if crc is not None:
+                limit -= DFU_SUFFIX_LENGTH
+            in_place = all(
+                len(patches[n]) == 1 + PATCH_SKIP[n] and
+                offset + len(patches[n]) <= limit
+                for n, offset in found)
+
+            if in_place:
+                if crc is not None:
+                    for n, offset in found:
+                        crc = dfu_crc_replace(
+                            crc, len(data) - 4, offset,
+                            data[offset:offset + len(patches[n])], patches[n])
+
+                with TIMINGS.stage('firmware.write'):
+                    shutil.copyfile(firmware, output)
+                    write_patches(output, patches, found, crc)
+                saved = [False] * len(PATCH_MARKERS)
+                for n, offset in found:
+                    saved[n] = True
+                if TIMINGS.enabled:
+                    TIMINGS.count('firmware.bytes_copied', len(data))
+                    TIMINGS.count('firmware.bytes_written', sum(
+                        len(patches[n]) for n, offset in found) +
+                        (4 if crc is not None else 0))
+            else:
+                with TIMINGS.stage('firmware.write'), \
+                        open(output, 'wb') as outfile:
+                    # The CRC is computed again as the file is written
+                    if crc is None:
+                        saved = patch_firmware(data, outfile, patches, found)
+                    else:
+                        writer = DFUWriter(outfile)
+                        saved = patch_firmware(data, writer, patches, found)
+                        writer.close()
+                    if TIMINGS.enabled:
+                        TIMINGS.count('firmware.bytes_written',
+                                      outfile.tell())
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    return saved
+
+
+def build_outputs(theme_dirs, firmwares, out_dir):
+    """Returns the output file of every theme/firmware pair
+
+    Raises ValueError if two pairs would write the same file, e.g. themes
+    of the same name from different directories.
+    """
+
+    jobs = []
+    outputs = {}
+    for theme_dir in theme_dirs:
+        # Keep outputs apart when building more than one theme
+        target = out_dir
+        if len(theme_dirs) > 1:
+            name = os.path.basename(os.path.normpath(theme_dir))
+            if name.endswith(THEME_BUNDLE_EXT):
+                name = name[:-len(THEME_BUNDLE_EXT)]
+            target = os.path.join(out_dir, name)
+
+        for firmware in firmwares:
+            output = os.path.join(
+                target, "custom_" + os.path.basename(firmware))
+            key = os.path.normcase(os.path.abspath(output))
+            if key in outputs:
+                raise ValueError(
+                    "Themes '{0}' and '{1}' would both be written to "
+                    "'{2}'".format(outputs[key][0], theme_dir, output))
+            outputs[key] = (theme_dir, firmware)
+            jobs.append((theme_dir, firmware, output))
+
+    return jobs
+
+
+def build(theme_dirs, firmwares, out_dir, workers=None):
+    """Patches every firmware with every theme in a process pool
+
+    Prints a summary line per job, returns True if all patches were saved.
+    """
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    jobs = build_outputs(theme_dirs, firmwares, out_dir)
+    for theme_dir, firmware, output in jobs:
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        config = (TIMINGS.enabled, TIMINGS.profile)
+        loading = [pool.submit(timed_job, config, load_theme, theme_dir)
+                   for theme_dir in theme_dirs]
+
+        # A theme that can't be loaded fails its own jobs only
+        themes = {}
+        for theme_dir, future in zip(theme_dirs, loading):
+            try:
+                themes[theme_dir] = build_patches(*pool_result(future))
+            except (IOError, OSError, ValueError) as e:
+                themes[theme_dir] = e
+
+        return run_pool(
+            [(output, themes[theme_dir]
+              if isinstance(themes[theme_dir], Exception) else
+              (firmware, output, themes[theme_dir]))
+             for theme_dir, firmware, output in jobs],
+            build_firmware, lambda args, saved: (
+                "functionsSaved={0} colorsSaved={1} "
+                "defaultSaved={2}".format(*saved)),
+            all, pool=pool)
+
+
+def verify_firmware(firmware):
+    """Checks the DFU CRC and patch markers of a firmware file
+
+    Returns the CRC check (None if the file has no DFU suffix) and whether
+    each of the PATCH_MARKERS was found.
+    """
+
+    with open(firmware, 'rb') as infile:
+        data = map_file(infile)
+        try:
+            found = [False] * len(PATCH_MARKERS)
+            with TIMINGS.stage('firmware.scan'):
+                scanned = find_patches(data)
+            for n, offset in scanned:
+                found[n] = True
+
+            crc_ok = None
+            if has_dfu_suffix(data):
+                with memoryview(data) as view:
+                    crc_ok = dfu_crc(view[:-4]) == \
+                        int.from_bytes(data[-4:], 'little')
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    return crc_ok, found
+
+
+def verify(firmwares, workers=None):
+    """Verifies firmware files, or directories of them, in a process pool
+
+    Prints a summary line per file, returns True if all of them are valid.
+    """
+
+    def describe(args, result):
+        crc_ok, found = result
+        return "dfuCRC={0} functions={1} colors={2} defaults={3}".format(
+            {None: 'none', True: 'OK', False: 'BAD'}[crc_ok], *found)
+
+    return run_pool(
+        [(firmware, (firmware,)) for firmware in firmware_files(firmwares)],
+        verify_firmware, describe,
+        lambda result: result[0] is not False and all(result[1]), workers)
+
+
+def extract_firmware(firmware, directory):
+    """Saves the theme of a patched firmware file into a directory"""
+
+    with open(firmware, 'rb') as infile:
+        data = map_file(infile)
+        try:
+            images, colors = read_patches(data)
+        except ValueError:
+            raise ValueError("LCD data not found in '{0}'".format(firmware))
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    save_theme(directory, images, colors)
+
+
+def extract(firmwares, out_dir, workers=None):
+    """Extracts the themes of firmware files, or directories of them, in a
+    process pool
+
+    With more than one file each theme gets a sub-directory named after the
+    file. Prints a summary line per file, returns True if all succeeded.
+    """
+
+    firmwares = firmware_files(firmwares)
+    jobs = []
+    for firmware in firmwares:
+        target = out_dir
+        if len(firmwares) > 1:
+            name = os.path.basename(firmware)
+            if name.endswith('.dfu.bin'):
+                name = name[:-len('.dfu.bin')]
+            target = os.path.join(out_dir, name)
+        jobs.append((firmware, (firmware, target)))
+
+    return run_pool(
+        jobs, extract_firmware,
+        lambda args, result: "extracted to {0}".format(args[1]),
+        workers=workers)
+
+
+def bundle_theme(theme_dir, output):
+    """Saves a theme directory as a theme bundle"""
+
+    save_theme_bundle(output, *load_theme(theme_dir))
+
+
+def bundle(theme_dirs, out_dir, workers=None):
+    """Bundles theme directories in a process pool
+
+    Each bundle is named after its directory. Prints a summary line per
+    theme, returns True if all succeeded.
+    """
+
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(theme_dir, (theme_dir, os.path.join(out_dir, os.path.basename(
+        os.path.normpath(theme_dir)) + THEME_BUNDLE_EXT)))
+        for theme_dir in theme_dirs]
+
+    return run_pool(
+        jobs, bundle_theme,
+        lambda args, result: "bundled to {0}".format(args[1]),
+        workers=workers)
+
+
+def import_to_bmp(source, output, n, dither, threshold, fit, cache):
+    """Converts an image for slot n and saves it as a BMP"""
+
+    unpack_image(import_image(
+        source, n, dither, threshold, fit, cache)).save(output)
+
+
+def import_images(sources, n, out_dir, dither=IMPORT_DITHER,
+                  threshold=IMPORT_THRESHOLD, fit=IMPORT_FIT,
+                  cache=IMPORT_CACHE, workers=None):
+    """Converts images, or directories of them, for slot n in a process pool
+
+    Each image is saved in out_dir as a BMP of the same name. Prints a
+    summary line per image, returns True if all succeeded.
+    """
+
+    files = []
+    for source in sources:
+        if os.path.isdir(source):
+            files.extend(
+                os.path.join(source, name)
+                for name in sorted(os.listdir(source))
+                if os.path.isfile(os.path.join(source, name)))
+        else:
+            files.append(source)
+
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(source, (source, os.path.join(out_dir, os.path.splitext(
+        os.path.basename(source))[0] + '.bmp'), n, dither, threshold, fit,
+        cache)) for source in files]
+
+    return run_pool(
+        jobs, import_to_bmp,
+        lambda args, result: "imported to {0}".format(args[1]),
+        workers=workers)
+
+
+def animate(path, port, fps, loops, color):
+    """Streams an animation to a keyboard and prints the throughput"""
+
+    try:
+        frames = load_animation(path)
+    except (IOError, OSError, ValueError) as e:
+        print("error: {0}".format(e), file=sys.stderr)
+        return 1
+
+    if port is None:
+        ports = PortMonitor.find_ports()
+        if not ports:
+            print("error: no keyboard found", file=sys.stderr)
+            return 1
+        port = ports[0]
+
+    session = SerialSession(port)
+    try:
+        shown, dropped, elapsed, sent = session.animate(
+            frames, tuple(int(655.35 * max(0, min(c, 100))) for c in color),
+            fps, loops)
+    except (IOError, OSError, ValueError) as e:
+        print("error: {0}".format(e), file=sys.stderr)
+        return 1
+    finally:
+        session.close()
+
+    print("{0} frames in {1:.2f} s: {2:.1f} fps, {3} dropped, "
+          "{4:.0f} bytes/s".format(
+              shown, elapsed, shown / elapsed if elapsed else 0, dropped,
+              sent / elapsed if elapsed else 0))
+    return 0
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""
+Infinity ErgoDox LCD Editor keyboard emulator, by LuX
+Answers the lcdInit, lcdColor and lcdDisp CLI commands on a pseudo-terminal
+like the keyboard does, keeping the framebuffer and backlight color, so the
+serial code can be tried and measured without a keyboard. Linux only.
+
+Code distributed "as is", use at your own risk
+"""
+
+import argparse
+import os
+import pty
+import sys
+import threading
+import tty
+from time import sleep
+
+from iedlcde_core import CLI_PROMPT
+
+
+# Seconds the emulated keyboard takes to handle each command
+EMULATOR_LATENCY = {
+    b'lcdInit': 0.0,
+    b'lcdColor': 0.0,
+    b'lcdDisp': 0.0,
+}
+
+# Bytes of the keyboard CLI line buffer
+EMULATOR_LINE_BUFFER = 128
+
+
+class IEDEmulator(object):
+    """Emulated keyboard CLI on a pseudo-terminal
+
+    Open `port` with pyserial like a keyboard port. `frame` is the 128 x 32
+    framebuffer as 4 pages of 128 columns, the layout of lcd_frame(), and
+    `color` the last lcdColor values. `commands` counts the handled commands
+    by name. latency overrides EMULATOR_LATENCY for some commands.
+
+    Like the keyboard, what arrives goes into one EMULATOR_LINE_BUFFER byte
+    line buffer and only its first line is run, so commands sent before
+    the previous one was answered are lost. They are kept in `errors`.
+    """
+
+    def __init__(self, latency=None):
+        self.latency = dict(EMULATOR_LATENCY)
+        if latency is not None:
+            self.latency.update(latency)
+
+        self.frame = bytearray(4 * 128)
+        self.color = None
+        self.commands = {}
+        self.errors = []
+        self.lock = threading.Lock()
+
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Closes the pseudo-terminal, the port stops working"""
+
+        for fd in (self.slave, self.master):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    def reset(self):
+        """Forgets the LCD state and the handled commands"""
+
+        with self.lock:
+            self.frame = bytearray(4 * 128)
+            self.color = None
+            self.commands = {}
+            self.errors = []
+
+    def handle(self, line):
+        """Runs a command line, returns the output before the prompt"""
+
+        words = line.split()
+        if not words:
+            return b''
+        name = words[0]
+
+        try:
+            args = [int(w, 0) for w in words[1:]]
+        except ValueError:
+            self.errors.append(line)
+            return b'Invalid argument\r\n'
+
+        sleep(self.latency.get(name, 0))
+
+        with self.lock:
+            if name == b'lcdInit':
+                self.frame[:] = bytes(4 * 128)
+            elif name == b'lcdColor' and len(args) == 3:
+                self.color = tuple(args)
+            elif name == b'lcdDisp' and len(args) >= 2 and \
+                    0 <= args[0] < 4 and 0 <= args[1] < 128:
+                page, column, data = args[0], args[1], args[2:]
+                data = bytes(b & 0xFF for b in data[:128 - column])
+                start = page * 128 + column
+                self.frame[start:start + len(data)] = data
+            else:
+                self.errors.append(line)
+                return b'Invalid command\r\n'
+
+            self.commands[name] = self.commands.get(name, 0) + 1
+
+        return b''
+
+    def _run(self):
+        """Emulator thread main loop"""
+
+        buf = b''
+        while True:
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            if not data:
+                return
+
+            buf += data
+            if len(buf) > EMULATOR_LINE_BUFFER:
+                with self.lock:
+                    self.errors.append(buf)
+                buf = b''
+                continue
+            if b'\r' not in buf:
+                continue
+
+            # The rest of the buffer is dropped with the line
+            line, rest = buf.split(b'\r', 1)
+            buf = b''
+            if rest:
+                with self.lock:
+                    self.errors.append(rest)
+
+            # Echoed like the keyboard CLI does
+            output = self.handle(line)
+            try:
+                os.write(self.master, line + b'\r\n' + output + CLI_PROMPT)
+            except OSError:
+                return
+
+
+def main(argv=None):
+    """Runs an emulator until interrupted"""
+
+    parser = argparse.ArgumentParser(
+        prog='iedlcde_emulator',
+        description="emulate the keyboard LCD CLI on a pseudo-terminal")
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help="seconds taken by every command")
+    args = parser.parse_args(argv)
+
+    emulator = IEDEmulator(dict.fromkeys(EMULATOR_LATENCY, args.latency))
+    print(emulator.port)
+    sys.stdout.flush()
+    try:
+        while True:
+            sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,862 @@
+"""
+Infinity ErgoDox LCD Editor GUI, by LuX
+
+Code distributed "as is", use at your own risk
+"""
+
+import queue
+import sys
+import threading
+from collections import OrderedDict
+from functools import partial
+from time import time
+from tkinter import *
+from PIL import Image, ImageTk
+import easygui as gui
+
+from iedlcde_core import (
+    __title__, __version__, __author__, DEFAULT_COLORS, TIMINGS, LCDUpload,
+    PortMonitor, SerialSession, SerialWorker, ThemeLibrary, ThemeWatcher,
+    build_firmware, build_patches, import_image, lcd_frame, load_colors,
+    save_colors, unpack_image)
+
+
+# GLOBALS
+IDERR = 0
+IDOK = 1
+IDCANCEL = 2
+IDABORT = 3
+IDRETRY = 4
+IDIGNORE = 5
+IDYES = 6
+IDNO = 7
+IDTRYAGAIN = 10
+IDCONTINUE = 11
+
+in_image = [None] * 8
+image_data = [bytearray() for y in range(8)]
+
+THEME_LIBRARY = 'themes'  # directory of the theme bundles
+
+STARTUP_BUDGET = 1.0  # seconds until the images and colors are shown
+
+# Swatch brightness of the color values, approximating the LCD backlight
+_GAMMA = [int(pow(v, 1 / 4) * 80.638) for v in range(0, 101)]
+
+
+class Application(object):
+    """IED LCD Editor main application"""
+
+    root = None
+
+    display_frame = [None for y in range(8)]
+    display_photo = [None for y in range(8)]
+
+    color_slide = [[None for x in range(3)] for y in range(8)]
+    color_value = [[None for x in range(3)] for y in range(8)]
+    color_int = [[None for x in range(3)] for y in range(8)]
+    color_box = [None for y in range(8)]
+
+    img_buttons = [[None for x in range(3)] for y in range(8)]
+    gui_buttons = [None for y in range(7)]
+
+    author_box = None
+    live_box = None
+    status_box = None
+    watch_box = None
+    push_box = None
+
+    sessions = None
+    workers = None
+    selected = None
+    results = None
+    ports = None
+    monitor = None
+    live_value = None
+    uploads = [None for y in range(8)]
+    dirty_colors = None
+    repaint_id = None
+    timing_panel = None
+    timing_text = None
+    timing_value = None
+    watcher = None
+    watch_value = None
+    push_value = None
+    library = None
+    library_panel = None
+    library_list = None
+    library_filter = None
+    library_names = None
+
+    def __init__(self, started=None, report=False):
+        if started is None:
+            started = time()
+        self.started = started
+        self.report = report
+
+        self.root = Tk()
+        self.root.title("{} {}".format(__title__, __version__))
+        self.root.resizable(0, 0)
+
+        # Make color scales, set once colors.txt is loaded
+        self.dirty_colors = set()
+
+        for i in range(0, 8):
+            for c in range(0, 3):
+                colorr = "red"
+                if c == 1:
+                    colorr = "green"
+                elif c == 2:
+                    colorr = "blue"
+
+                self.color_value[i][c] = IntVar()
+                self.color_slide[i][c] = Scale(
+                    self.root, bg=colorr, from_=0, to=100,
+                    variable=self.color_value[i][c], orient=HORIZONTAL,
+                    showvalue=0, width=12, length=200, sliderlength=20,
+                    command=lambda value, ind=i, chan=c:
+                        self.color_changed(ind, chan))
+                self.color_slide[i][c].place(x=40, y=20 + i * 80 + c * 20)
+
+                self.color_int[i][c] = Label(self.root, text="0%")
+                self.color_int[i][c].place(x=5, y=19 + i * 80 + c * 20)
+
+            self.color_box[i] = Label(
+                self.root, text="", width=1, padx=71,
+                height=1, pady=19, bg="#FFFFFF")
+            self.color_box[i].place(x=260, y=22 + i * 80)
+
+        # Blank images, shown once the images are loaded
+        for i in range(0, 8):
+            self.display_photo[i] = ImageTk.PhotoImage(
+                Image.new("1", (128, 32), "white"))
+
+            self.display_frame[i] = Label(
+                self.root, image=self.display_photo[i], padx=0, pady=0)
+            self.display_frame[i].place(x=270, y=32 + i * 80)
+            self.display_frame[i].bind(
+                '<Button-1>', lambda event, ind=i: self.import_slot(ind))
+
+        for i in range(0, 8):
+            self.img_buttons[i][0] = Button(
+                self.root, text='Preview', bg='#AAAAAA',
+                font=('arial', 8), width=14, pady=-2,
+                command=lambda ind=i: self.preview_setting(ind))
+            self.img_buttons[i][0].place(x=430, y=15 + i * 80)
+            self.img_buttons[i][1] = Button(
+                self.root, text='Reload Image', bg='#999999',
+                font=('arial', 8), width=14, pady=-2,
+                command=lambda ind=i: self.reload_image(ind))
+            self.img_buttons[i][1].place(x=430, y=38 + i * 80)
+            self.img_buttons[i][2] = Button(
+                self.root, text='Reload Color', bg='#888888',
+                font=('arial', 8), width=14, pady=-2,
+                command=lambda ind=i: self.reload_color(ind))
+            self.img_buttons[i][2].place(x=430, y=61 + i * 80)
+
+        self.gui_buttons[0] = Button(
+            self.root, text='Default colors', bg='#9999AA',
+            width=20, pady=-2, command=self.default_all)
+        self.gui_buttons[0].place(x=10, y=665)
+        self.gui_buttons[1] = Button(
+            self.root, text='Reload all', bg='#99AA99',
+            width=20, pady=-2, command=self.reload_all)
+        self.gui_buttons[1].place(x=195, y=665)
+        self.gui_buttons[2] = Button(
+            self.root, text='Exit', bg='#AA9999',
+            width=20, pady=-2, command=self.root.destroy)
+        self.gui_buttons[2].place(x=380, y=665)
+        self.gui_buttons[3] = Button(
+            self.root, text='Save LEFT.dfu.bin', bg='#44FF44',
+            width=20, pady=-2,
+            command=lambda left=True: self.save_to_file(left))
+        self.gui_buttons[3].place(x=10, y=700)
+        self.gui_buttons[4] = Button(
+            self.root, text='Save RIGHT.dfu.bin', bg='#44FF44',
+            width=20, pady=-2,
+            command=lambda left=False: self.save_to_file(left))
+        self.gui_buttons[4].place(x=195, y=700)
+        self.gui_buttons[5] = Button(
+            self.root, text='Connect to IED', bg='#faff00',
+            width=20, pady=-2, command=self.connect_ied)
+        self.gui_buttons[5].place(x=380, y=700)
+
+        self.author_box = Label(
+            self.root, text='by: {}'.format(', '.join(__author__)))
+        self.author_box.place(x=10, y=730)
+
+        self.live_value = IntVar()
+        self.live_box = Checkbutton(
+            self.root, text='Live color', variable=self.live_value)
+        self.live_box.place(x=195, y=728)
+
+        self.status_box = Label(self.root, text='')
+        self.status_box.place(x=380, y=730)
+
+        self.watch_value = IntVar()
+        self.watch_box = Checkbutton(
+            self.root, text='Watch files', variable=self.watch_value,
+            command=self.toggle_watch)
+        self.watch_box.place(x=195, y=750)
+
+        self.push_value = IntVar()
+        self.push_box = Checkbutton(
+            self.root, text='Auto push', variable=self.push_value)
+        self.push_box.place(x=290, y=750)
+
+        self.gui_buttons[6] = Button(
+            self.root, text='Themes', bg='#AAAAAA', font=('arial', 8),
+            width=14, pady=-2, command=self.toggle_library)
+        self.gui_buttons[6].place(x=430, y=750)
+        self.library = ThemeLibrary(THEME_LIBRARY)
+
+        self.sessions = OrderedDict()
+        self.workers = {}
+        self.results = queue.Queue()
+        self.monitor = PortMonitor()
+        self.poll_worker()
+        self.root.bind('<Escape>', self.cancel_preview)
+        self.root.bind('<F12>', self.toggle_timings)
+        if TIMINGS.enabled:
+            self.toggle_timings()
+
+        # Keyboards are connected to as the port monitor finds them, the
+        # images and colors are loaded in the background
+        threading.Thread(target=self.load_files, daemon=True).start()
+
+        self.root.geometry("580x780")
+        self.startup_times = [time() - self.started, None]
+        self.root.mainloop()
+
+    # Startup #
+    def load_files(self):
+        """Loads the images and colors, runs on a background thread"""
+
+        images = []
+        colors = None
+        error = None
+
+        # Load images as LCD data, converting them to the slot size
+        for n in range(0, 8):
+            try:
+                data = import_image("F{0}.bmp".format(n), n)
+            except (IOError, OSError):
+                error = ("Error loading image 'F{0}.bmp'\n"
+                         "The app will now close".format(n), "File not found")
+                break
+            except ValueError as e:
+                error = ("{0}\nThe app will now close".format(e),
+                         "Invalid image")
+                break
+
+            images.append((unpack_image(data), data))
+
+        if error is None:
+            try:
+                colors = load_colors('colors.txt')
+            except (IOError, OSError):
+                error = ("Error loading 'colors.txt'!\n"
+                         "The app will now close", "File not found")
+            except ValueError as e:
+                error = ("{0}\nThe app will now close".format(e),
+                         "Invalid file")
+
+        self.results.put((self.files_loaded, (images, colors), error))
+
+    def files_loaded(self, result, error):
+        """Shows the loaded images and colors"""
+
+        if error is not None:
+            gui.msgbox(*error)
+            exit(1)
+
+        images, colors = result
+        for i in range(0, 8):
+            in_image[i], image_data[i] = images[i]
+            self.uploads[i] = None
+            self.show_image(i)
+
+        for i in range(0, 8):
+            for c in range(0, 3):
+                self.color_slide[i][c].set(int(colors[i * 3 + c]))
+
+        self.startup_times[1] = time() - self.started
+        if TIMINGS.enabled:
+            TIMINGS.record('gui.window', self.startup_times[0])
+            TIMINGS.record('gui.files', self.startup_times[1])
+        if self.report or self.startup_times[1] > STARTUP_BUDGET:
+            print("startup: window {0:.3f} s, files {1:.3f} s "
+                  "(budget {2:.3f} s)".format(
+                      self.startup_times[0], self.startup_times[1],
+                      STARTUP_BUDGET), file=sys.stderr)
+
+    # Serial #
+    def connect_ied(self):
+        """Look for connected keyboards and select the ones to use"""
+
+        # Find all available COM ports
+        port_list = self.monitor.scan()
+        self.ports = port_list
+        for port in port_list:
+            if port not in self.sessions:
+                self.add_session(port, True)
+
+        # Select ports to use
+        if len(port_list) > 1:
+            com_selection = gui.multchoicebox(
+                "Please select COM ports to use", "Select COM ports",
+                port_list)
+            if com_selection:
+                self.selected = set(com_selection)
+                self.update_status()
+        elif len(port_list) == 1:
+            self.selected = None
+            self.update_status()
+
+    def add_session(self, port, report=False):
+        """Starts a session and its worker for a new port"""
+
+        session = SerialSession(port)
+        self.sessions[port] = session
+        self.workers[port] = SerialWorker(self.results)
+
+        self.workers[port].submit(
+            'session', lambda cancel: session.open(),
+            partial(self.connect_done, session, report))
+
+    def target_sessions(self):
+        """Returns the sessions actions are sent to, of plugged in ports"""
+
+        ports = self.monitor.ports
+        return [session for port, session in self.sessions.items()
+                if port in ports and
+                (self.selected is None or port in self.selected)]
+
+    def update_status(self):
+        """Shows the connected keyboards"""
+
+        ports = [session.port for session in self.target_sessions()
+                 if session.connected]
+        if ports:
+            self.status_box['text'] = 'Connected to: {}'.format(
+                ', '.join(ports))
+        else:
+            self.status_box['text'] = ''
+
+    def connect_done(self, session, report, result, error):
+        """Reports the result of connecting"""
+
+        if error is not None and not isinstance(error, (IOError, OSError)):
+            raise error
+
+        if error is not None and report:
+            gui.msgbox(
+                "Could not connect to the Infinity Ergodox on {}!\n"
+                "If the keyboard was just connected, wait a couple "
+                "of seconds before trying to connect.".format(session.port),
+                "Connection error")
+
+        # Failed connections are tried again after the next port scan
+        self.update_status()
+
+    def sync_ports(self):
+        """Follows keyboards being unplugged and plugged back in"""
+
+        ports = self.monitor.ports
+        if ports is self.ports:
+            return
+        self.ports = ports
+
+        for port in ports:
+            if port not in self.sessions:
+                self.add_session(port)
+
+        for port, session in self.sessions.items():
+            if port in ports and not session.connected:
+                self.workers[port].submit(
+                    'session', lambda cancel, session=session: session.open(),
+                    partial(self.connect_done, session, False))
+            elif port not in ports and session.connected:
+                self.workers[port].submit(
+                    'session', lambda cancel, session=session: session.close(),
+                    partial(self.connect_done, session, False))
+
+    def lcd_color(self, i):
+        """Returns the lcdColor values of a slot"""
+
+        return tuple(int(655.35 * self.color_value[i][c].get())
+                     for c in range(0, 3))
+
+    def lcd_upload(self, i):
+        """Returns the compiled upload of a slot, recompiled if its color
+        changed"""
+
+        if not image_data[i]:
+            return None
+
+        color = self.lcd_color(i)
+        if self.uploads[i] is None or self.uploads[i].color != color:
+            self.uploads[i] = LCDUpload(color, lcd_frame(image_data[i]))
+
+        return self.uploads[i]
+
+    def preview_setting(self, i):
+        """Show preview of image and color on the selected keyboards"""
+
+        # Compiled here, Tk isn't used from the workers
+        upload = self.lcd_upload(i)
+        if upload is None:
+            return
+
+        for session in self.target_sessions():
+            self.workers[session.port].submit(
+                'preview', partial(session.preview, upload),
+                partial(self.preview_done, session))
+
+    def cancel_preview(self, event=None):
+        """Cancels the running previews"""
+
+        for session in self.target_sessions():
+            self.workers[session.port].cancel('preview')
+
+    def preview_done(self, session, result, error):
+        """Reports the result of a preview"""
+
+        if error is None:
+            return
+        if not isinstance(error, (IOError, OSError)):
+            raise error
+
+        self.update_status()
+        if gui.ccbox(
+                "Error while previewing an image on {}!\n"
+                "Try to reconnect to keyboard?".format(session.port),
+                "Error"):
+            self.connect_ied()
+
+    def stream_color(self, i):
+        """Sends the color of a slot to the keyboards in live mode"""
+
+        color = self.lcd_color(i)
+
+        for session in self.target_sessions():
+            # Colors arriving while one is sent replace each other
+            self.workers[session.port].submit(
+                'color', partial(session.stream_color, color),
+                partial(self.stream_color_done, session))
+
+    def stream_color_done(self, session, result, error):
+        """Reports a live color that couldn't be sent, without a dialog"""
+
+        if error is None:
+            return
+        if not isinstance(error, (IOError, OSError)):
+            raise error
+
+        self.status_box['text'] = 'Could not send the color to: {}'.format(
+            session.port)
+
+    def poll_worker(self):
+        """Collects finished serial jobs and port changes"""
+
+        self.root.after(50, self.poll_worker)
+
+        while True:
+            try:
+                done, result, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            done(result, error)
+
+        self.sync_ports()
+
+    # GUI #
+    def color_changed(self, i, c):
+        """Called when color slider c of slot i moves"""
+
+        # Repainted once Tk is idle, however many sliders moved
+        self.dirty_colors.add((i, c))
+        if self.repaint_id is None:
+            self.repaint_id = self.root.after_idle(self.repaint_colors)
+
+        if self.live_value is not None and self.live_value.get():
+            self.stream_color(i)
+
+    def repaint_colors(self):
+        """Updates the labels and swatches of the changed color values"""
+
+        self.repaint_id = None
+        dirty = self.dirty_colors
+        self.dirty_colors = set()
+
+        for i, c in dirty:
+            self.color_int[i][c].config(
+                text="{0}%".format(self.color_value[i][c].get()))
+
+        for i in set(i for i, c in dirty):
+            self.color_box[i].config(bg='#%02x%02x%02x' % tuple(
+                _GAMMA[self.color_value[i][c].get()] for c in range(0, 3)))
+
+    def reload_image(self, i):
+        """Reloads the image from file"""
+
+        try:
+            image_data[i] = import_image("F{0}.bmp".format(i), i)
+        except (IOError, OSError, ValueError):
+            self.root.destroy()
+            return
+
+        in_image[i] = unpack_image(image_data[i])
+        self.uploads[i] = None
+
+        # Re-present the GUI image
+        self.show_image(i)
+
+    def import_slot(self, i):
+        """Imports any image into a slot, saving it as its F?.bmp"""
+
+        filename = gui.fileopenbox(
+            "Image for slot {0}".format(i), "Import image")
+        if not filename:
+            return
+
+        try:
+            data = import_image(filename, i)
+            unpack_image(data).save("F{0}.bmp".format(i))
+        except (IOError, OSError, ValueError):
+            gui.msgbox("Error importing '{}'!".format(filename),
+                       "Error while importing")
+            return
+
+        # Not a change to reload
+        if self.watcher is not None:
+            self.watcher.refresh("F{0}.bmp".format(i))
+
+        image_data[i] = data
+        in_image[i] = unpack_image(data)
+        self.uploads[i] = None
+        self.show_image(i)
+
+    def show_image(self, i):
+        """Presents the image of a slot in the GUI"""
+
+        temp_img = Image.new("1", (128, 32), "white")
+        temp_img.paste(in_image[i], (0, 0))
+        self.display_photo[i] = ImageTk.PhotoImage(temp_img)
+        self.display_frame[i].config(image=self.display_photo[i])
+
+    def reload_color(self, i, colors=None):
+        """Reloads color value, from colors if they are already loaded"""
+
+        if colors is None:
+            colors = self.read_colors()
+
+        for c in range(0, 3):
+            self.color_slide[i][c].set(colors[i * 3 + c])
+
+    def read_colors(self):
+        """Reads colors.txt, the app closes if it can't be read"""
+
+        try:
+            return load_colors('colors.txt')
+        except (IOError, OSError):
+            gui.msgbox("Error loading 'colors.txt'!\n"
+                       "The app will now close", "File not found")
+        except ValueError as e:
+            gui.msgbox("{0}\nThe app will now close".format(e),
+                       "Invalid file")
+        exit(1)
+
+    def default_all(self):
+        """Resets values to default"""
+
+        # default images
+        # set images here...
+
+        # default colors (approximate)
+        for i in range(0, 8):
+            for c in range(0, 3):
+                self.color_slide[i][c].set(DEFAULT_COLORS[i * 3 + c])
+
+    def reload_all(self):
+        """Reload all values"""
+
+        colors = self.read_colors()
+        for i in range(0, 8):
+            self.reload_image(i)
+            self.reload_color(i, colors)
+
+    # Files #
+    def save_colors(self):
+        """Saves colors to file"""
+
+        save_colors("colors.txt", [self.color_value[i][c].get()
+                                   for i in range(0, 8) for c in range(0, 3)])
+
+        # Not a change to reload
+        if self.watcher is not None:
+            self.watcher.refresh("colors.txt")
+
+    def save_to_file(self, left_side=True):
+        """Saves data to .dfu.bin file"""
+
+        # Nothing to save until the images are loaded
+        if not all(image_data):
+            return
+
+        # Save color values
+        self.save_colors()
+
+        # Save data
+        dfu_file = "left_kiibohd.dfu.bin" if not left_side \
+            else "right_kiibohd.dfu.bin"
+
+        colors = [self.color_value[i][c].get()
+                  for i in range(0, 8) for c in range(0, 3)]
+        patches = build_patches(image_data, colors)
+
+        try:
+            with TIMINGS.stage('gui.save'):
+                functionsSaved, colorsSaved, defaultSaved = build_firmware(
+                    dfu_file, "custom_" + dfu_file[0:], patches)
+
+            if not (functionsSaved and colorsSaved and defaultSaved):
+                gui.msgbox(
+                    "An error may have occurred while saving '{}'!\n"
+                    "Remake the .dfu.bin files from the online "
+                    "configurator and try again".format(
+                        "custom_" + dfu_file[0:]), "Error while saving")
+            else:
+                gui.msgbox("'{}' Saved successfully!".format(
+                    "custom_" + dfu_file[0:]), "File saved")
+        except (IOError, OSError):
+            gui.msgbox(
+                "Error while saving file!", "File not found")
+
+    # Watching #
+    def toggle_watch(self):
+        """Starts or stops watching the theme files"""
+
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        if self.watch_value.get():
+            self.watcher = ThemeWatcher('.', self.load_changes)
+
+    def load_changes(self, names):
+        """Loads the changed theme files, runs on the watcher thread"""
+
+        images = {}
+        colors = None
+        failed = []
+
+        for n in range(0, 8):
+            if "F{0}.bmp".format(n) not in names:
+                continue
+            try:
+                data = import_image("F{0}.bmp".format(n), n)
+            except (IOError, OSError, ValueError):
+                # Half written, the next write is seen as another change
+                failed.append("F{0}.bmp".format(n))
+                continue
+            images[n] = (unpack_image(data), data)
+
+        if "colors.txt" in names:
+            try:
+                colors = load_colors("colors.txt")
+            except (IOError, OSError, ValueError):
+                failed.append("colors.txt")
+
+        self.results.put((self.changes_loaded, (images, colors, failed), None))
+
+    def changes_loaded(self, result, error):
+        """Shows the changed images and colors, pushing them if asked to"""
+
+        images, colors, failed = result
+        changed = set()
+
+        for i, (image, data) in images.items():
+            in_image[i] = image
+            if data != image_data[i]:
+                image_data[i] = data
+                self.uploads[i] = None
+                changed.add(i)
+            self.show_image(i)
+
+        if colors is not None:
+            for i in range(0, 8):
+                for c in range(0, 3):
+                    if self.color_value[i][c].get() != colors[i * 3 + c]:
+                        self.color_slide[i][c].set(colors[i * 3 + c])
+                        changed.add(i)
+
+        if failed:
+            self.status_box['text'] = 'Could not load: {}'.format(
+                ', '.join(failed))
+        else:
+            self.update_status()
+
+        # The LCD shows one slot at a time, the highest changed one is pushed
+        if changed and self.push_value.get():
+            self.preview_setting(max(changed))
+
+    # Theme library #
+    def toggle_library(self):
+        """Shows or hides the theme library"""
+
+        if self.library_panel is not None:
+            self.library_panel.destroy()
+            self.library_panel = None
+            return
+
+        self.library_panel = Toplevel(self.root)
+        self.library_panel.title("Themes")
+        self.library_panel.protocol("WM_DELETE_WINDOW", self.toggle_library)
+
+        self.library_filter = StringVar()
+        self.library_filter.trace_add(
+            'write', lambda *args: self.list_themes())
+        Entry(self.library_panel,
+              textvariable=self.library_filter).pack(fill=X)
+
+        frame = Frame(self.library_panel)
+        frame.pack(fill=BOTH, expand=1)
+        scroll = Scrollbar(frame)
+        scroll.pack(side=RIGHT, fill=Y)
+        self.library_list = Listbox(
+            frame, width=40, height=20, exportselection=0,
+            yscrollcommand=scroll.set)
+        self.library_list.pack(side=LEFT, fill=BOTH, expand=1)
+        scroll.config(command=self.library_list.yview)
+        self.library_list.bind('<<ListboxSelect>>', self.theme_selected)
+
+        Button(self.library_panel, text='Refresh', width=12, pady=-2,
+               command=self.list_themes).pack(side=LEFT)
+        Button(self.library_panel, text='Save current', width=12, pady=-2,
+               command=self.save_theme).pack(side=RIGHT)
+
+        self.list_themes()
+
+    def list_themes(self):
+        """Lists the themes of the library matching the filter"""
+
+        if self.library_panel is None:
+            return
+
+        text = self.library_filter.get().lower()
+        self.library_names = [name for name in self.library.names()
+                              if text in name.lower()]
+        self.library_list.delete(0, END)
+        for name in self.library_names:
+            self.library_list.insert(END, name)
+
+    def theme_selected(self, event=None):
+        """Switches to the selected theme"""
+
+        selection = self.library_list.curselection()
+        if selection:
+            self.switch_theme(self.library_names[selection[0]])
+
+    def switch_theme(self, name):
+        """Shows a theme of the library, it is what gets saved next"""
+
+        try:
+            with TIMINGS.stage('gui.theme'):
+                images, colors = self.library.load(name)
+        except (IOError, OSError, ValueError) as e:
+            gui.msgbox("Error loading theme '{0}'!\n{1}".format(name, e),
+                       "Error")
+            return
+
+        for i in range(0, 8):
+            image_data[i] = images[i]
+            in_image[i] = unpack_image(images[i])
+            self.uploads[i] = None
+            self.show_image(i)
+
+        for i in range(0, 8):
+            for c in range(0, 3):
+                self.color_slide[i][c].set(colors[i * 3 + c])
+
+    def save_theme(self):
+        """Stores the current images and colors in the library"""
+
+        if not all(image_data):
+            return
+
+        name = gui.enterbox("Theme name", "Save theme")
+        if not name:
+            return
+
+        try:
+            self.library.save(name, image_data, [
+                self.color_value[i][c].get()
+                for i in range(0, 8) for c in range(0, 3)])
+        except (IOError, OSError, ValueError):
+            gui.msgbox("Error while saving theme '{}'!".format(name),
+                       "Error while saving")
+            return
+
+        self.list_themes()
+
+    # Timing #
+    def toggle_timings(self, event=None):
+        """Shows or hides the timings panel"""
+
+        if self.timing_panel is not None:
+            self.timing_panel.destroy()
+            self.timing_panel = None
+            return
+
+        self.timing_panel = Toplevel(self.root)
+        self.timing_panel.title("Timings")
+        self.timing_panel.protocol("WM_DELETE_WINDOW", self.toggle_timings)
+
+        self.timing_value = IntVar(value=int(TIMINGS.enabled))
+        Checkbutton(
+            self.timing_panel, text='Record', variable=self.timing_value,
+            command=self.record_timings).pack(anchor=W)
+
+        self.timing_text = Label(
+            self.timing_panel, text='', font=('courier', 9), justify=LEFT,
+            anchor=NW, width=60, height=20)
+        self.timing_text.pack(fill=BOTH, expand=1)
+
+        Button(self.timing_panel, text='Reset', width=12, pady=-2,
+               command=TIMINGS.reset).pack(side=LEFT)
+        Button(self.timing_panel, text='Save JSON', width=12, pady=-2,
+               command=self.save_timings).pack(side=RIGHT)
+
+        self.refresh_timings()
+
+    def record_timings(self):
+        """Turns recording of the timings on or off"""
+
+        TIMINGS.enabled = bool(self.timing_value.get())
+
+    def refresh_timings(self):
+        """Shows the latest timings, twice a second while the panel is open"""
+
+        if self.timing_panel is None:
+            return
+
+        lines = TIMINGS.summary()
+        if not lines:
+            lines = ["Nothing recorded yet" if TIMINGS.enabled
+                     else "Recording is off"]
+        self.timing_text['text'] = '\n'.join(lines)
+        self.timing_panel.after(500, self.refresh_timings)
+
+    def save_timings(self):
+        """Saves the timings to a JSON file"""
+
+        filename = gui.filesavebox(
+            "Save the timings as", "Save timings", "iedlcde_timings.json")
+        if not filename:
+            return
+
+        try:
+            TIMINGS.dump(filename)
+        except (IOError, OSError):
+            gui.msgbox("Error while saving '{}'!".format(filename),
+                       "Error while saving")
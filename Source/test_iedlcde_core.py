@@ -0,0 +1,269 @@
+"""
+Tests of the Infinity ErgoDox LCD Editor core
+
+Run with: python -m unittest discover Source
+"""
+
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+from iedlcde_bench import synthetic_firmware
+from iedlcde_core import (
+    DEFAULT_COLORS, PATCH_MARKERS, PATCH_SKIP, THEME_BUNDLE_MAGIC,
+    THEME_SLOT_SIZES, build_firmware, build_patches, find_patches,
+    import_image, load_theme_bundle, pack_image, patch_firmware,
+    read_patches, save_theme_bundle, unpack_image, verify_firmware)
+
+
+def pack_pixels(image):
+    """Packs an image pixel by pixel like the original getpixel loop"""
+
+    imgwidth = image.width
+    data = bytearray(4 * imgwidth)
+    for p in range(0, 4):
+        for z in range(0, 8):
+            for x in range(0, imgwidth):
+                if image.getpixel((x, (3 - p) * 8 + 7 - z)) == 0:
+                    data[p * imgwidth + x] |= (1 << z)
+
+    return data
+
+
+def random_image(rng, width):
+    """Returns a random 1-bit image of the given width"""
+
+    return Image.frombytes("1", (width, 32), bytes(
+        rng.getrandbits(8) for i in range(width * 32 // 8)))
+
+
+class PackImageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(82904)
+
+    def test_matches_pixel_loop(self):
+        for width in (128, 32):
+            for k in range(20):
+                image = random_image(self.rng, width)
+                self.assertEqual(pack_image(image), pack_pixels(image))
+
+    def test_blank_images(self):
+        for color, byte in (("white", 0x00), ("black", 0xFF)):
+            image = Image.new("1", (32, 32), color)
+            self.assertEqual(pack_image(image), bytes([byte]) * 128)
+
+    def test_unpack_round_trips(self):
+        for width in (128, 32):
+            for k in range(20):
+                image = random_image(self.rng, width)
+                unpacked = unpack_image(pack_image(image))
+                self.assertEqual(unpacked.size, image.size)
+                self.assertEqual(unpacked.tobytes(), image.tobytes())
+
+
+def patch_bytes(data, images, colors):
+    """Patches firmware data byte by byte like the original sstr loop
+
+    Returns the output and which patches were written.
+    """
+
+    infile = io.BytesIO(data)
+    outfile = io.BytesIO()
+    functionsSaved = colorsSaved = defaultSaved = False
+    sstr = b"12345678901234567890"
+
+    while True:
+        byte = infile.read(1)
+        sstr = (sstr + byte)[1:]
+        if byte == b'':
+            break
+
+        if not functionsSaved and sstr == PATCH_MARKERS[0]:
+            functionsSaved = True
+            outfile.write(bytes(2))
+            for n in range(1, 8):
+                outfile.write(bytes(images[n]))
+            infile.read(897)
+        elif not colorsSaved and sstr == PATCH_MARKERS[1]:
+            colorsSaved = True
+            outfile.write(bytes([0x8D]))
+            for col in range(1, 8):
+                for chan in range(0, 3):
+                    lo, hi = divmod(int(655.35 * colors[col * 3 + chan]),
+                                    1 << 8)
+                    outfile.write(bytes([hi, lo]))
+            infile.read(42)
+        elif not defaultSaved and sstr == PATCH_MARKERS[2]:
+            defaultSaved = True
+            outfile.write(b"." + bytes(1) + bytes(images[0]))
+            infile.read(513)
+        else:
+            outfile.write(byte)
+
+    return outfile.getvalue(), [functionsSaved, colorsSaved, defaultSaved]
+
+
+class PatchFirmwareTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(82904)
+
+    def random_bytes(self, size):
+        return bytes(self.rng.getrandbits(8) for i in range(size))
+
+    def random_firmware(self):
+        """Random data with markers, parts of them and markers that
+        overlap or straddle the regions skipped by a patch"""
+
+        parts = []
+        for k in range(self.rng.randrange(8)):
+            parts.append(self.random_bytes(
+                self.rng.choice((0, 1, 5, 19, 40, 500, 1000))))
+            kind = self.rng.randrange(5)
+            if kind < 3:
+                parts.append(PATCH_MARKERS[kind])
+            elif kind == 3:
+                first, second = self.rng.sample(PATCH_MARKERS, 2)
+                parts.append(first[:self.rng.randrange(20)] +
+                             second[self.rng.randrange(20):])
+
+        for n, other in ((0, 1), (1, 2), (2, 0)):
+            if self.rng.random() < 0.3:
+                # The other marker starts inside the skipped region
+                cut = self.rng.randrange(1, len(PATCH_MARKERS[other]))
+                parts.insert(0, PATCH_MARKERS[n] +
+                             self.random_bytes(PATCH_SKIP[n] - cut) +
+                             PATCH_MARKERS[other])
+
+        return b''.join(parts)
+
+    def test_matches_byte_loop(self):
+        for k in range(300):
+            data = self.random_firmware()
+            images = [self.random_bytes(size) for size in THEME_SLOT_SIZES]
+            colors = [self.rng.randrange(101) for i in range(24)]
+
+            outfile = io.BytesIO()
+            saved = patch_firmware(data, outfile,
+                                   build_patches(images, colors))
+            self.assertEqual((outfile.getvalue(), saved),
+                             patch_bytes(data, images, colors))
+
+    def test_truncated_skip(self):
+        for n, marker in enumerate(PATCH_MARKERS):
+            data = b'abc' + marker + bytes(10)
+            self.assertEqual(find_patches(data), [(n, 3 + len(marker) - 1)])
+
+            outfile = io.BytesIO()
+            images = [bytes(size) for size in THEME_SLOT_SIZES]
+            saved = patch_firmware(data, outfile,
+                                   build_patches(images, DEFAULT_COLORS))
+            self.assertEqual((outfile.getvalue(), saved),
+                             patch_bytes(data, images, DEFAULT_COLORS))
+
+
+class BuildFirmwareTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(82904)
+        self.directory = tempfile.mkdtemp()
+        self.firmware = os.path.join(self.directory, "base.dfu.bin")
+        self.output = os.path.join(self.directory, "custom.dfu.bin")
+        synthetic_firmware(self.firmware, 65536, self.rng)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def random_images(self, sizes):
+        return [bytearray(self.rng.getrandbits(8) for i in range(size))
+                for size in sizes]
+
+    def test_in_place(self):
+        images = self.random_images(THEME_SLOT_SIZES)
+        saved = build_firmware(self.firmware, self.output,
+                               build_patches(images, DEFAULT_COLORS))
+
+        self.assertEqual(saved, [True] * 3)
+        self.assertEqual(verify_firmware(self.output), (True, [True] * 3))
+        with open(self.output, 'rb') as f:
+            self.assertEqual(read_patches(f.read()),
+                             (images, DEFAULT_COLORS))
+
+    def test_streamed(self):
+        # Patches of other lengths can't be written in place
+        images = self.random_images([512] * 8)
+        saved = build_firmware(self.firmware, self.output,
+                               build_patches(images, DEFAULT_COLORS))
+
+        self.assertEqual(saved, [True] * 3)
+        self.assertEqual(verify_firmware(self.output), (True, [True] * 3))
+
+
+class ImportImageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(82904)
+        self.directory = tempfile.mkdtemp()
+        self.cache = os.path.join(self.directory, "cache")
+        self.filename = os.path.join(self.directory, "F1.bmp")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_slot_size_not_cached(self):
+        image = random_image(self.rng, 32)
+        image.save(self.filename)
+        self.assertEqual(import_image(self.filename, 1, cache=self.cache),
+                         pack_image(image))
+        self.assertFalse(os.path.exists(self.cache))
+
+    def test_other_sizes_cached(self):
+        random_image(self.rng, 128).save(self.filename)
+        data = import_image(self.filename, 1, cache=self.cache)
+        self.assertEqual(len(os.listdir(self.cache)), 1)
+        self.assertEqual(import_image(self.filename, 1, cache=self.cache),
+                         data)
+        self.assertEqual(len(data), THEME_SLOT_SIZES[1])
+
+
+class ThemeBundleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(82904)
+        self.directory = tempfile.mkdtemp()
+        self.bundle = os.path.join(self.directory, "theme.iedt")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trips(self):
+        images = [bytearray(self.rng.getrandbits(8) for i in range(size))
+                  for size in THEME_SLOT_SIZES]
+        save_theme_bundle(self.bundle, images, DEFAULT_COLORS)
+        self.assertEqual(load_theme_bundle(self.bundle),
+                         (images, DEFAULT_COLORS))
+
+    def test_short_files(self):
+        for data in (b'', THEME_BUNDLE_MAGIC, THEME_BUNDLE_MAGIC + b'\x01',
+                     THEME_BUNDLE_MAGIC + bytes(12)):
+            with open(self.bundle, 'wb') as f:
+                f.write(data)
+            self.assertRaises(ValueError, load_theme_bundle, self.bundle)
+
+    def test_failed_save_leaves_nothing(self):
+        # A directory can't be replaced by the bundle
+        os.mkdir(self.bundle)
+        images = [bytes(size) for size in THEME_SLOT_SIZES]
+        self.assertRaises(OSError, save_theme_bundle, self.bundle, images,
+                          DEFAULT_COLORS)
+        self.assertEqual(os.listdir(self.directory), ["theme.iedt"])
+
+
+if __name__ == '__main__':
+    unittest.main()